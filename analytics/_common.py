@@ -0,0 +1,560 @@
+#!/usr/bin/env python3
+"""
+直近7日間分析スクリプト（analyze_7days / analyze_7days_purchase_only /
+analyze_moodmarkgift_7days / analyze_funnel_contribution）の共通定義
+
+集計・保存のヘルパー（build_cube / rollup_cube / save_json など）は
+christmas_season_report_2024 / content_performance_analyzer からも使う。
+API取得結果のキャッシュ（cache_file_path / read_cache / write_cache）は
+oauth_google_apis / christmas_season_report_2024 で、スレッドごとのHTTPクライアント
+（thread_http）はさらに check_permissions / check_gsc_permissions とも共通。
+"""
+
+import hashlib
+import json
+import logging
+import math
+import os
+import pickle
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Optional
+
+import google_auth_httplib2
+import httplib2
+import numpy as np
+import pandas as pd
+
+from oauth_google_apis import OAuthGoogleAPIsIntegration, GA4Query, ga4_prefix_filter
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+# スレッドごとの認証済みHTTPクライアント（thread_http 参照）
+_thread_local = threading.local()
+
+# 7日間分析のGA4キャッシュ有効期間（秒）
+GA4_CACHE_TTL = 3600
+
+# SEOメディア（MOO:D MARK GIFT）とECサイト（MOO:D MARK）を判定するパスの部分文字列
+GIFT_PATH = '/moodmarkgift/'
+EC_PATH = '/moodmark/'
+
+# 件数系の指標（downcast_counts で int32 にする候補）
+# 比率・平均・金額の指標（bounceRate・averageSessionDuration・purchaseRevenue など）は含めない
+COUNT_METRICS = (
+    'sessions', 'activeUsers', 'totalUsers', 'newUsers', 'screenPageViews',
+    'conversions', 'ecommercePurchases', 'engagedSessions'
+)
+
+# site_kind が返すカテゴリ（コード順）
+SITE_KINDS = ('gift', 'ec', 'other')
+
+# MOO:D MARK（ECサイト）のみに絞り込むdimensionFilter（moodmarkgiftを除外）
+MOODMARK_LANDING_FILTER = ga4_prefix_filter('landingPage', '/moodmark', exclude_prefix='/moodmarkgift/')
+MOODMARK_PAGE_PATH_FILTER = ga4_prefix_filter('pagePath', '/moodmark', exclude_prefix='/moodmarkgift/')
+
+# 両スクリプトで同じディメンションを使うリクエストは指標を統合し、
+# 同一リクエスト（＝同一キャッシュキー）として共有する
+# 絞り込みはdimensionFilterで行うため landingPage はディメンションに含めず、
+# GA4側で集計キーごとに1行へ集計させる
+MOODMARK_DAILY_QUERY = GA4Query(
+    ['sessions', 'activeUsers', 'screenPageViews', 'conversions', 'bounceRate',
+     'averageSessionDuration', 'ecommercePurchases', 'purchaseRevenue'],
+    ['date'],
+    MOODMARK_LANDING_FILTER
+)
+MOODMARK_DEVICE_QUERY = GA4Query(
+    ['sessions', 'activeUsers', 'conversions', 'bounceRate', 'ecommercePurchases', 'purchaseRevenue'],
+    ['deviceCategory'],
+    MOODMARK_LANDING_FILTER
+)
+MOODMARK_CHANNEL_QUERY = GA4Query(
+    ['sessions', 'activeUsers', 'conversions', 'ecommercePurchases', 'purchaseRevenue'],
+    ['sessionDefaultChannelGrouping'],
+    MOODMARK_LANDING_FILTER
+)
+
+
+@lru_cache(maxsize=1)
+def get_api_client():
+    """
+    OAuth認証済みのAPIクライアントをプロセス内で共有する
+    
+    同じプロセスで複数の7日間分析を続けて実行するとき、2回目以降は
+    トークン読み込み・リフレッシュとGA4/GSCサービスの構築を省略できる。
+    """
+    return OAuthGoogleAPIsIntegration()
+
+
+def thread_http(credentials, timeout=None):
+    """
+    呼び出し元スレッド専用の認証済みHTTPクライアントを返す
+    
+    httplib2.Http はスレッドセーフではないためスレッドごとに持ち、同じスレッドでの
+    後続リクエストでは接続を使い回す。クライアントは認証情報（とタイムアウト）ごとに持つ。
+    認証情報は参照を保持して同一性を確かめるため、別の認証情報と取り違えることはない。
+    
+    Args:
+        credentials: google-auth の認証情報
+        timeout (int): 通信のタイムアウト秒数（Noneなら httplib2 の既定値）
+    """
+    https = getattr(_thread_local, 'https', None)
+    if https is None:
+        https = _thread_local.https = {}
+    key = (id(credentials), timeout)
+    entry = https.get(key)
+    if entry is None or entry[0] is not credentials:
+        http = google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http(timeout=timeout))
+        entry = https[key] = (credentials, http)
+    return entry[1]
+
+
+def cache_file_path(cache_dir, kind, **params):
+    """
+    取得条件から決まるキャッシュファイルのパス
+    
+    kind と params をキーにしたJSONのblake2bダイジェストをファイル名にする
+    （<cache_dir>/<kind>_<digest>.pkl）。params はJSONにできる値であること。
+    """
+    key = json.dumps({'kind': kind, **params}, sort_keys=True)
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest()
+    return os.path.join(cache_dir, f'{kind}_{digest}.pkl')
+
+
+def read_cache(path, cache_ttl):
+    """
+    期限内のキャッシュがあれば返す（なければNone）
+    
+    cache_ttl は保存からの有効秒数。None なら期限なし（確定済みの過去データ用）。
+    """
+    try:
+        if cache_ttl is not None and time.time() - os.path.getmtime(path) >= cache_ttl:
+            return None
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"キャッシュ読み込みエラー: {e}")
+        return None
+
+
+def write_cache(path, obj):
+    """
+    取得結果をキャッシュに保存する
+    
+    一時ファイルに書いてから os.replace で置き換えるため、並列に実行しても
+    読み込み側が書きかけのファイルを読むことはない。
+    """
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.warning(f"キャッシュ保存エラー: {e}")
+
+
+@dataclass
+class Section:
+    """分析セクションの集計結果（データがなければ df は None）"""
+    df: Optional[pd.DataFrame] = None
+    totals: dict = field(default_factory=dict)
+
+
+class GA4Runner:
+    """
+    7日間分析スクリプト共通のGA4取得処理
+    
+    認証済みクライアント（get_api_client）をプロセス内で共有し、
+    プロパティ・期間・キャッシュ設定をまとめて保持する。
+    同じプロセスで複数のスクリプトを実行しても認証は1回で済む。
+    """
+    
+    def __init__(self, property_id, date_range_days=7, cache_ttl=GA4_CACHE_TTL):
+        self.api = get_api_client()
+        self.property_id = property_id
+        self.date_range_days = date_range_days
+        self.cache_ttl = cache_ttl
+    
+    @property
+    def authenticated(self):
+        """OAuth認証に成功していればTrue"""
+        return bool(self.api.credentials)
+    
+    def fetch(self, queries, categorical=False):
+        """
+        複数のGA4リクエストを並列に取得する
+        
+        Args:
+            queries (dict): 結果のキー -> GA4Query
+            categorical (bool): get_ga4_data にそのまま渡すcategory型変換の指定
+        
+        Returns:
+            dict: 結果のキー -> pd.DataFrame（文字列列はto_arrow_strings、
+                件数系の指標はdowncast_countsで変換済み）
+        """
+        ga4 = self.api.get_ga4_data_concurrent(
+            queries,
+            date_range_days=self.date_range_days,
+            property_id=self.property_id,
+            cache_ttl=self.cache_ttl,
+            categorical=categorical
+        )
+        # 文字列の絞り込み・集計をArrowのC++実装で行い（pyarrowがある場合）、
+        # 件数系の指標は int32 にして集計時のメモリを半分にする
+        return {name: downcast_counts(to_arrow_strings(df), COUNT_METRICS) for name, df in ga4.items()}
+    
+    def fetch_scalar(self, metrics, dimension_filter=None):
+        """ディメンションなしで期間全体の集計値を取得する（get_ga4_scalar と同じ辞書）"""
+        return self.api.get_ga4_scalar(
+            metrics,
+            date_range_days=self.date_range_days,
+            property_id=self.property_id,
+            dimension_filter=dimension_filter
+        )
+
+
+def attach_pageviews(df_session, df_pv, key, columns):
+    """
+    GA4側で key ごとに集計済みのセッション系データに、同じキーのPVを結合する
+    
+    Args:
+        df_session: key ごとに1行のDataFrame（landingPageベース）
+        df_pv: key ごとに1行の screenPageViews を持つDataFrame（pagePathベース）
+        key: 結合キーの列名
+        columns: df_session から残す指標の列名リスト
+    
+    Returns:
+        pd.DataFrame: key, columns, screenPageViews（PV未計測のキーは0埋め）
+    """
+    summary = df_session[[key] + columns].merge(df_pv[[key, 'screenPageViews']], on=key, how='left')
+    summary['screenPageViews'] = summary['screenPageViews'].fillna(0)
+    return summary
+
+
+def to_arrow_strings(df):
+    """
+    object型の文字列列（pagePath・pageTitle など）を pyarrow バックエンドの string 型に変換する
+    
+    pyarrowがインストールされていなければ何もしない。
+    """
+    if pa is None or df.empty:
+        return df
+    columns = df.select_dtypes(include='object').columns
+    if len(columns) == 0:
+        return df
+    return df.astype({col: 'string[pyarrow]' for col in columns})
+
+
+def downcast_counts(df, columns):
+    """
+    件数系の指標（sessions・conversions など）を int32 に変換する
+    
+    GA4の指標値はすべて float64 で返るため、columns のうち全値が整数で int32 に収まる列だけを変換する。
+    比率系の指標（bounceRate など）は columns に含めなければ、値が整数でも float64 のまま残る。
+    
+    Args:
+        df (pd.DataFrame): GA4の取得結果
+        columns (iterable): 変換候補の指標名（df にない列は無視する）
+    """
+    if df.empty:
+        return df
+    int32 = np.iinfo(np.int32)
+    columns = [
+        col for col in columns
+        if col in df.columns
+        and df[col].dtype == np.float64
+        and df[col].notna().all()
+        and (df[col] % 1 == 0).all()
+        and df[col].between(int32.min, int32.max).all()
+    ]
+    if not columns:
+        return df
+    return df.astype({col: 'int32' for col in columns})
+
+
+def _unique_values(series):
+    """
+    列を (各行のユニーク値インデックス, ユニーク値) に分解する
+    
+    pagePath などは同じ値が日付・デバイスをまたいで何度も現れるため、
+    文字列判定はユニーク値に対してだけ行い、結果をインデックスで各行へ展開する。
+    欠損値のインデックスは -1（ユニーク値配列の末尾の次＝判定結果の番兵）になる。
+    """
+    codes, uniques = pd.factorize(series)
+    return codes, np.asarray(uniques, dtype=object)
+
+
+def contains_mask(series, needle, case=True):
+    """
+    文字列列に needle を含む行のboolean配列を返す
+    
+    Series.str.contains(needle, regex=False, na=False) と同じ判定を、
+    ユニーク値に対する単純な in 演算で行う（文字列以外の値はFalse）
+    
+    Args:
+        series (pd.Series): 判定する文字列の列
+        needle (str): 含まれるか調べる部分文字列
+        case (bool): Falseなら大文字小文字を区別しない
+    
+    Returns:
+        np.ndarray: series と同じ長さのbool配列
+    """
+    if case:
+        return _unique_mask(series, lambda s: needle in s)
+    needle = needle.lower()
+    return _unique_mask(series, lambda s: needle in s.lower())
+
+
+def startswith_mask(series, prefix):
+    """
+    文字列列が prefix で始まる行のboolean配列を返す
+    
+    Series.str.startswith(prefix, na=False) と同じ判定を、ユニーク値（category型ならカテゴリ）に
+    対してだけ行う（文字列以外の値はFalse）
+    
+    Returns:
+        np.ndarray: series と同じ長さのbool配列
+    """
+    return _unique_mask(series, lambda s: s.startswith(prefix))
+
+
+def _unique_mask(series, predicate):
+    """
+    文字列のユニーク値ごとに predicate を1回だけ評価し、結果を各行へ展開したboolean配列を返す
+    
+    文字列以外の値（欠損値を含む）は predicate を呼ばずにFalseとする。
+    """
+    codes, uniques = _unique_values(series)
+    matched = np.fromiter(
+        (isinstance(s, str) and predicate(s) for s in uniques),
+        dtype=bool,
+        count=len(uniques)
+    )
+    # 末尾のFalseは欠損値（codes == -1）用
+    return np.append(matched, False)[codes]
+
+
+def filter_path(df, needle, column='pagePath', exclude=None):
+    """
+    パスの列に needle を含む（exclude を含まない）行に絞り込む
+    
+    GA4の取得結果が空（列もない）場合は判定をせずにそのまま返す。
+    
+    Args:
+        df (pd.DataFrame): GA4の取得結果
+        needle (str): 含む行を残す部分文字列
+        column (str): 判定する列（pagePath / landingPage）
+        exclude (str): 含む行を除く部分文字列
+    
+    Returns:
+        pd.DataFrame: 絞り込んだDataFrame
+    """
+    if df.empty:
+        return df
+    mask = contains_mask(df[column], needle)
+    if exclude:
+        mask &= ~contains_mask(df[column], exclude)
+    return df[mask]
+
+
+def _site_kind_code(path):
+    """1つのパスを SITE_KINDS のコード（0: gift, 1: ec, 2: other）に分類する"""
+    if not isinstance(path, str):
+        return 2
+    if GIFT_PATH in path:
+        return 0
+    if EC_PATH in path:
+        return 1
+    return 2
+
+
+def site_kind(series):
+    """
+    パスの列を SEOメディア（gift）/ ECサイト（ec）/ その他（other）に分類する
+    
+    GIFT_PATH を含めば gift、含まず EC_PATH を含めば ec。
+    部分文字列の判定はユニーク値ごとに1回だけ行う。
+    
+    Returns:
+        pd.Categorical: SITE_KINDS をカテゴリとする分類結果
+    """
+    codes, uniques = _unique_values(series)
+    # 末尾の2（other）は欠損値（codes == -1）用
+    kinds = np.fromiter((_site_kind_code(s) for s in uniques), dtype=np.int8, count=len(uniques))
+    return pd.Categorical.from_codes(np.append(kinds, 2)[codes], categories=SITE_KINDS)
+
+
+def site_masks(series):
+    """
+    パスの列からSEOメディア・ECサイトのboolean配列を作る
+    
+    contains_mask(series, GIFT_PATH) と
+    contains_mask(series, EC_PATH) & ~contains_mask(series, GIFT_PATH) に等しい
+    
+    Returns:
+        tuple: (is_gift, is_ec) の np.ndarray
+    """
+    kinds = site_kind(series).codes
+    return kinds == 0, kinds == 1
+
+
+def weight_rates(df, rates, weight='sessions'):
+    """
+    比率系の指標（bounceRate など）に weight を掛け、groupby で sum できる形にする
+    
+    GA4の比率は行ごとに集計済みの値なので、平均ではなくセッション数による
+    加重平均で集計する。集計後に unweight_rates で比率へ戻す。
+    """
+    return df.assign(**{rate: df[rate] * df[weight] for rate in rates})
+
+
+def unweight_rates(summary, rates, weight='sessions'):
+    """weight_rates で掛けた weight を割り戻し、加重平均の比率にする（weightが0なら0）"""
+    total = summary[weight].where(summary[weight] > 0)
+    return summary.assign(**{rate: (summary[rate] / total).fillna(0) for rate in rates})
+
+
+def build_cube(df, keys, agg_spec):
+    """
+    keys の組み合わせで一度だけ集計した中間テーブルを作る
+    
+    各ディメンション別の集計は rollup_cube でこのテーブルを再集計して求める。
+    agg_spec で 'mean' を指定した指標は平均の平均にならないよう、
+    合計と件数（<指標>_count）を持たせる。
+    
+    Args:
+        df (pd.DataFrame): 集計元のデータ
+        keys (list): 中間テーブルのキーにする列
+        agg_spec (dict): 指標 -> 'sum' / 'mean'
+    
+    Returns:
+        pd.DataFrame: keys をインデックスとする中間テーブル（df が空なら空のDataFrame）
+    """
+    if df.empty:
+        return pd.DataFrame()
+    
+    mean_metrics = [metric for metric, how in agg_spec.items() if how == 'mean']
+    grouped = df.groupby(keys, dropna=False, observed=True)
+    cube = grouped[list(agg_spec)].sum()
+    return cube.join(grouped[mean_metrics].count().add_suffix('_count'))
+
+
+def rollup_cube(cube, dimension, agg_spec):
+    """build_cube の中間テーブルを1つのディメンションで再集計する（agg_spec どおりの合計・平均）"""
+    totals = cube.groupby(level=dimension, observed=True).sum()
+    for metric, how in agg_spec.items():
+        if how == 'mean':
+            totals[metric] = totals[metric] / totals[f'{metric}_count']
+    return totals[list(agg_spec)].reset_index()
+
+
+def save_csv(df, path):
+    """
+    DataFrameをExcelで開けるBOM付きUTF-8のCSVとして保存する
+    
+    pyarrowのCSVライターはヘッダーと文字列を常に引用符で囲み、
+    浮動小数点数の書式（12.0 -> 12 など）も to_csv と異なるため使わない
+    """
+    df.to_csv(path, index=False, encoding='utf-8-sig')
+
+
+def _json_default(obj):
+    """
+    orjson / json が直接扱えない値をJSONで表せる値に変換する（save_json の両経路で共通）
+    
+    numpyの値はPythonの値に、日時（pd.Timestamp を含む）はISO 8601の文字列に、
+    欠損値（NaN・inf・NaT・pd.NA）はNone（null）にする。
+    """
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.datetime64):
+        obj = pd.Timestamp(obj)
+    elif isinstance(obj, np.generic):
+        obj = obj.item()
+    if obj is pd.NaT or obj is pd.NA or (isinstance(obj, float) and not math.isfinite(obj)):
+        return None
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if obj is None or isinstance(obj, (str, int, float)):
+        return obj
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _to_json_compatible(obj):
+    """
+    標準のjsonで orjson と同じ出力になるよう、値とキーを再帰的に変換する
+    
+    値は _json_default で変換し（NaNはnullになる）、日時のキーは orjson の
+    OPT_NON_STR_KEYS と同じくISO 8601の文字列にする。
+    """
+    if isinstance(obj, dict):
+        return {
+            (key.isoformat() if isinstance(key, (datetime, date)) else key): _to_json_compatible(value)
+            for key, value in obj.items()
+        }
+    if isinstance(obj, (list, tuple)):
+        return [_to_json_compatible(value) for value in obj]
+    if isinstance(obj, (str, bool)) or obj is None:
+        return obj
+    value = _json_default(obj)
+    return value if value is obj else _to_json_compatible(value)
+
+
+def save_json(report, path):
+    """
+    レポート辞書をインデント付きUTF-8のJSONとして保存する
+    
+    orjsonがインストールされていればそちらで直接バイト列を書き出し、
+    なければ標準のjsonにフォールバックする。どちらの経路でも出力は同じで、
+    numpyの値・日時・欠損値は _json_default のとおりに変換し、
+    文字列以外のキー（数値・bool・None・日時）は文字列にする。
+    """
+    if orjson is not None:
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(
+                report,
+                option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+                default=_json_default
+            ))
+        return
+    
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(_to_json_compatible(report), f, ensure_ascii=False, indent=2)
+
+
+def write_outputs(csv_files, report, report_file, max_workers=4):
+    """
+    CSVとJSONレポートを並列に書き出し、保存先を表示する
+    
+    それぞれ別ファイルへの書き込みで互いに競合しないため、スレッドでまとめて発行する。
+    
+    Args:
+        csv_files (list): (表示名, DataFrame, 保存先) のリスト
+        report (dict): JSONレポート
+        report_file (str): JSONレポートの保存先
+        max_workers (int): 同時書き込み数の上限
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        futures = [(label, path, ex.submit(save_csv, df, path)) for label, df, path in csv_files]
+        futures.append(('統合レポート', report_file, ex.submit(save_json, report, report_file)))
+        
+        for label, path, fut in futures:
+            fut.result()
+            print(f"✅ {label}: {path}")
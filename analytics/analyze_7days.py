@@ -10,21 +10,38 @@
 
 import sys
 import os
-import json
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from oauth_google_apis import OAuthGoogleAPIsIntegration
+from oauth_google_apis import GA4Query
+from _common import (
+    GA4_CACHE_TTL,
+    MOODMARK_LANDING_FILTER,
+    MOODMARK_PAGE_PATH_FILTER,
+    MOODMARK_DAILY_QUERY,
+    MOODMARK_DEVICE_QUERY,
+    MOODMARK_CHANNEL_QUERY,
+    attach_pageviews,
+    get_api_client,
+    write_outputs,
+    Section,
+)
+
+# レポート出力先はインポート時に一度だけ作成する
+os.makedirs('data/processed', exist_ok=True)
 
 def analyze_7days():
     """直近7日間の詳細分析を実行"""
     
+    # ファイル名とレポート日時で同じ時刻を使う
+    now = datetime.now()
+    
     print("\n" + "=" * 70)
     print("  MOO:D MARK サイト分析レポート - 直近7日間")
     print("  https://isetan.mistore.jp/moodmark")
     print("=" * 70)
     
     # API初期化
-    api = OAuthGoogleAPIsIntegration()
+    api = get_api_client()
     
     if not api.credentials:
         print("\n❌ 認証に失敗しました")
@@ -34,218 +51,124 @@ def analyze_7days():
     
     property_id = "316302380"
     
+    # 各セクションのGA4リクエストは互いに独立しているため、まとめて並列取得
+    # （全サイト共通指標は集計値1行だけなので、DataFrameを作らずに別スレッドで取得）
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        overall_future = ex.submit(
+            api.get_ga4_scalar,
+            ['sessions', 'bounceRate', 'averageSessionDuration'],
+            date_range_days=7,
+            property_id=property_id
+        )
+        ga4 = api.get_ga4_data_concurrent(
+            {
+                # セッション数とユーザー数（landingPageベース）
+                'session': MOODMARK_DAILY_QUERY,
+                # PV数（pagePathベース）
+                'pv': GA4Query(['screenPageViews'], ['date'], MOODMARK_PAGE_PATH_FILTER),
+                'device_session': MOODMARK_DEVICE_QUERY,
+                'device_pv': GA4Query(['screenPageViews'], ['deviceCategory'], MOODMARK_PAGE_PATH_FILTER),
+                'channel': MOODMARK_CHANNEL_QUERY,
+                'page': GA4Query(['screenPageViews', 'sessions'], ['pagePath'], MOODMARK_PAGE_PATH_FILTER),
+                'hourly': GA4Query(['sessions', 'activeUsers'], ['hour'], MOODMARK_LANDING_FILTER),
+            },
+            date_range_days=7,
+            property_id=property_id,
+            cache_ttl=GA4_CACHE_TTL,
+            categorical=True
+        )
+    
+    # 各セクションの集計結果（データがなければ df=None のまま）
+    daily, device, channel, page = Section(), Section(), Section(), Section()
+    
     # 1. セッション数とユーザー数（landingPageベース）
     print("1️⃣  日別トレンド分析")
     print("-" * 70)
     
-    session_data = api.get_ga4_data(
-        date_range_days=7,
-        metrics=['sessions', 'activeUsers', 'conversions'],
-        dimensions=['date', 'landingPage'],
-        property_id=property_id
-    )
-    
-    # PV数（pagePathベース）
-    pv_data = api.get_ga4_data(
-        date_range_days=7,
-        metrics=['screenPageViews'],
-        dimensions=['date', 'pagePath'],
-        property_id=property_id
-    )
-    
-    if not session_data.empty and not pv_data.empty:
-        # ECサイトでランディングしたセッション
-        ec_session_data = session_data[
-            (session_data['landingPage'].str.contains('/moodmark', na=False)) & 
-            (~session_data['landingPage'].str.contains('/moodmarkgift/', na=False))
-        ]
+    # ECサイトでランディングしたセッション / ECサイトのPV（API側で絞り込み済み）
+    ec_session_data = ga4['session']
+    ec_pv_data = ga4['pv']
+    
+    if not ec_session_data.empty and not ec_pv_data.empty:
+        # セッション・ユーザー・コンバージョン（GA4側で日別に集計済み）とPVのマージ
+        daily_data = attach_pageviews(ec_session_data, ec_pv_data, 'date',
+                                      ['sessions', 'activeUsers', 'conversions'])
+        daily_data = daily_data.sort_values('date')
+        
+        # 7日間の合計は以降のセクションとレポートで使い回す
+        totals = daily_data[['sessions', 'activeUsers', 'screenPageViews', 'conversions']].sum().to_dict()
+        pages_per_session = totals['screenPageViews'] / totals['sessions'] if totals['sessions'] > 0 else 0
         
-        # ECサイトのPV
-        ec_pv_data = pv_data[
-            (pv_data['pagePath'].str.contains('/moodmark', na=False)) & 
-            (~pv_data['pagePath'].str.contains('/moodmarkgift/', na=False))
-        ]
+        print(daily_data.to_string(index=False))
         
-        if not ec_session_data.empty and not ec_pv_data.empty:
-            # セッション・ユーザー・コンバージョン集計
-            session_summary = ec_session_data.groupby('date').agg({
-                'sessions': 'sum',
-                'activeUsers': 'sum',
-                'conversions': 'sum'
-            }).reset_index()
-            
-            # PV集計
-            pv_summary = ec_pv_data.groupby('date').agg({
-                'screenPageViews': 'sum'
-            }).reset_index()
-            
-            # マージ
-            daily_data = session_summary.merge(pv_summary, on='date', how='left')
-            daily_data['screenPageViews'] = daily_data['screenPageViews'].fillna(0)
-            daily_data = daily_data.sort_values('date')
-            
-            print(daily_data.to_string(index=False))
-            
-            # 合計値
-            print("\n📈 7日間の合計:")
-            print(f"   総セッション数: {daily_data['sessions'].sum():,.0f}")
-            print(f"   アクティブユーザー数: {daily_data['activeUsers'].sum():,.0f}")
-            print(f"   総ページビュー数: {daily_data['screenPageViews'].sum():,.0f}")
-            print(f"   総コンバージョン数: {daily_data['conversions'].sum():,.0f}")
-            print(f"   PV/セッション: {daily_data['screenPageViews'].sum() / daily_data['sessions'].sum():.2f}")
-        else:
-            print("⚠️ moodmarkのデータが見つかりませんでした")
-            daily_data = pd.DataFrame()
+        # 合計値
+        print("\n📈 7日間の合計:")
+        print(f"   総セッション数: {totals['sessions']:,.0f}")
+        print(f"   アクティブユーザー数: {totals['activeUsers']:,.0f}")
+        print(f"   総ページビュー数: {totals['screenPageViews']:,.0f}")
+        print(f"   総コンバージョン数: {totals['conversions']:,.0f}")
+        print(f"   PV/セッション: {pages_per_session:.2f}")
+        
+        daily = Section(daily_data, totals)
     else:
-        daily_data = pd.DataFrame()
+        print("⚠️ moodmarkのデータが見つかりませんでした")
     
     # 2. デバイス別分析
     print("\n\n2️⃣  デバイス別分析")
     print("-" * 70)
     
-    device_session_data = api.get_ga4_data(
-        date_range_days=7,
-        metrics=['sessions', 'activeUsers', 'conversions'],
-        dimensions=['deviceCategory', 'landingPage'],
-        property_id=property_id
-    )
-    
-    device_pv_data = api.get_ga4_data(
-        date_range_days=7,
-        metrics=['screenPageViews'],
-        dimensions=['deviceCategory', 'pagePath'],
-        property_id=property_id
-    )
-    
-    if not device_session_data.empty and not device_pv_data.empty:
-        ec_device_session = device_session_data[
-            (device_session_data['landingPage'].str.contains('/moodmark', na=False)) & 
-            (~device_session_data['landingPage'].str.contains('/moodmarkgift/', na=False))
-        ]
-        
-        ec_device_pv = device_pv_data[
-            (device_pv_data['pagePath'].str.contains('/moodmark', na=False)) & 
-            (~device_pv_data['pagePath'].str.contains('/moodmarkgift/', na=False))
-        ]
+    ec_device_session = ga4['device_session']
+    ec_device_pv = ga4['device_pv']
+    
+    if not ec_device_session.empty and not ec_device_pv.empty:
+        device_summary = attach_pageviews(ec_device_session, ec_device_pv, 'deviceCategory',
+                                          ['sessions', 'activeUsers', 'conversions'])
+        device_summary = device_summary.sort_values('deviceCategory')
+        device_summary['conversion_rate'] = (device_summary['conversions'] / device_summary['sessions'] * 100).round(2)
+        device_summary['session_share'] = (device_summary['sessions'] / device_summary['sessions'].sum() * 100).round(1)
         
-        if not ec_device_session.empty and not ec_device_pv.empty:
-            device_session_summary = ec_device_session.groupby('deviceCategory').agg({
-                'sessions': 'sum',
-                'activeUsers': 'sum',
-                'conversions': 'sum'
-            }).reset_index()
-            
-            device_pv_summary = ec_device_pv.groupby('deviceCategory').agg({
-                'screenPageViews': 'sum'
-            }).reset_index()
-            
-            device_summary = device_session_summary.merge(device_pv_summary, on='deviceCategory', how='left')
-            device_summary['screenPageViews'] = device_summary['screenPageViews'].fillna(0)
-            device_summary['conversion_rate'] = (device_summary['conversions'] / device_summary['sessions'] * 100).round(2)
-            device_summary['session_share'] = (device_summary['sessions'] / device_summary['sessions'].sum() * 100).round(1)
-            
-            print(device_summary.to_string(index=False))
-        else:
-            device_summary = pd.DataFrame()
-    else:
-        device_summary = pd.DataFrame()
+        print(device_summary.to_string(index=False))
+        device = Section(device_summary)
     
     # 3. チャネル別分析
     print("\n\n3️⃣  チャネル別分析（流入元）")
     print("-" * 70)
     
-    channel_data = api.get_ga4_data(
-        date_range_days=7,
-        metrics=['sessions', 'activeUsers', 'conversions'],
-        dimensions=['sessionDefaultChannelGrouping', 'landingPage'],
-        property_id=property_id
-    )
-    
-    if not channel_data.empty:
-        ec_channel_data = channel_data[
-            (channel_data['landingPage'].str.contains('/moodmark', na=False)) & 
-            (~channel_data['landingPage'].str.contains('/moodmarkgift/', na=False))
-        ]
+    ec_channel_data = ga4['channel']
+    
+    if not ec_channel_data.empty:
+        channel_summary = ec_channel_data[['sessionDefaultChannelGrouping', 'sessions', 'activeUsers', 'conversions']].copy()
+        channel_summary['conversion_rate'] = (channel_summary['conversions'] / channel_summary['sessions'] * 100).round(2)
+        channel_summary = channel_summary.sort_values('sessions', ascending=False)
         
-        if not ec_channel_data.empty:
-            channel_summary = ec_channel_data.groupby('sessionDefaultChannelGrouping').agg({
-                'sessions': 'sum',
-                'activeUsers': 'sum',
-                'conversions': 'sum'
-            }).reset_index()
-            
-            channel_summary['conversion_rate'] = (channel_summary['conversions'] / channel_summary['sessions'] * 100).round(2)
-            channel_summary = channel_summary.sort_values('sessions', ascending=False)
-            
-            print(channel_summary.to_string(index=False))
-        else:
-            channel_summary = pd.DataFrame()
-    else:
-        channel_summary = pd.DataFrame()
+        print(channel_summary.to_string(index=False))
+        channel = Section(channel_summary)
     
     # 4. 人気ページ分析（pagePathベース）
     print("\n\n4️⃣  人気ページ TOP10")
     print("-" * 70)
     
-    page_data = api.get_ga4_data(
-        date_range_days=7,
-        metrics=['screenPageViews', 'sessions'],
-        dimensions=['pagePath'],
-        property_id=property_id
-    )
-    
-    if not page_data.empty:
-        ec_page_data = page_data[
-            (page_data['pagePath'].str.contains('/moodmark', na=False)) & 
-            (~page_data['pagePath'].str.contains('/moodmarkgift/', na=False))
-        ]
+    ec_page_data = ga4['page']
+    
+    if not ec_page_data.empty:
+        page_summary = ec_page_data.sort_values('screenPageViews', ascending=False).head(10)
         
-        if not ec_page_data.empty:
-            page_summary = ec_page_data.groupby('pagePath').agg({
-                'screenPageViews': 'sum',
-                'sessions': 'sum'
-            }).reset_index()
-            
-            page_summary = page_summary.sort_values('screenPageViews', ascending=False).head(10)
-            
-            print(page_summary.to_string(index=False))
-        else:
-            page_summary = pd.DataFrame()
-    else:
-        page_summary = pd.DataFrame()
+        print(page_summary.to_string(index=False))
+        page = Section(page_summary)
     
     # 5. 時間帯別分析
     print("\n\n5️⃣  時間帯別アクセス分析")
     print("-" * 70)
     
-    hourly_data = api.get_ga4_data(
-        date_range_days=7,
-        metrics=['sessions', 'activeUsers'],
-        dimensions=['dateHour', 'landingPage'],
-        property_id=property_id
-    )
-    
-    if not hourly_data.empty:
-        ec_hourly_data = hourly_data[
-            (hourly_data['landingPage'].str.contains('/moodmark', na=False)) & 
-            (~hourly_data['landingPage'].str.contains('/moodmarkgift/', na=False))
-        ].copy()
+    ec_hourly_data = ga4['hourly']
+    
+    if not ec_hourly_data.empty:
+        # GA4のhourディメンションは"00"〜"23"の文字列なので一度だけ数値化する
+        ec_hourly_data['hour'] = ec_hourly_data['hour'].astype('int8')
         
-        if not ec_hourly_data.empty:
-            ec_hourly_data['hour'] = ec_hourly_data['dateHour'].astype(str).str[-2:].astype(int)
-            
-            hourly_summary = ec_hourly_data.groupby('hour').agg({
-                'sessions': 'sum',
-                'activeUsers': 'sum'
-            }).reset_index()
-            
-            hourly_summary = hourly_summary.sort_values('sessions', ascending=False).head(10)
-            print("アクセスが多い時間帯 TOP10:")
-            print(hourly_summary.to_string(index=False))
-        else:
-            hourly_summary = pd.DataFrame()
-    else:
-        hourly_summary = pd.DataFrame()
+        hourly_summary = ec_hourly_data.sort_values('sessions', ascending=False).head(10)
+        print("アクセスが多い時間帯 TOP10:")
+        print(hourly_summary.to_string(index=False))
     
     # 6. 全サイト共通指標の取得
     print("\n\n6️⃣  全サイト共通指標（参考値）")
@@ -253,29 +176,22 @@ def analyze_7days():
     print("※ 直帰率とセッション時間は両サイトが同じドメイン内にあるため、")
     print("  セッション単位では正確に分離できません。")
     
-    overall_data = api.get_ga4_data(
-        date_range_days=7,
-        metrics=['sessions', 'bounceRate', 'averageSessionDuration'],
-        dimensions=['date'],
-        property_id=property_id
-    )
+    overall = overall_future.result()
     
-    if not overall_data.empty:
+    if overall:
         print(f"\n全サイト平均:")
-        print(f"   平均直帰率: {overall_data['bounceRate'].mean():.1%}")
-        print(f"   平均セッション時間: {overall_data['averageSessionDuration'].mean():.0f}秒（{overall_data['averageSessionDuration'].mean()/60:.1f}分）")
+        print(f"   平均直帰率: {overall['bounceRate']:.1%}")
+        print(f"   平均セッション時間: {overall['averageSessionDuration']:.0f}秒（{overall['averageSessionDuration']/60:.1f}分）")
     
     # 7. コンバージョン分析
     print("\n\n7️⃣  コンバージョン分析")
     print("-" * 70)
     
-    if not daily_data.empty:
-        total_sessions = daily_data['sessions'].sum()
-        total_conversions = daily_data['conversions'].sum()
-        conversion_rate = (total_conversions / total_sessions * 100)
+    if daily.df is not None:
+        conversion_rate = (daily.totals['conversions'] / daily.totals['sessions'] * 100) if daily.totals['sessions'] > 0 else 0
         
-        print(f"総セッション数: {total_sessions:,.0f}")
-        print(f"総コンバージョン数: {total_conversions:,.0f}")
+        print(f"総セッション数: {daily.totals['sessions']:,.0f}")
+        print(f"総コンバージョン数: {daily.totals['conversions']:,.0f}")
         print(f"コンバージョン率: {conversion_rate:.2f}%")
         print("\n※ コンバージョンにはカート追加、商品閲覧等の複数イベントを含みます")
         print("※ 実際の購入完了率は analyze_7days_purchase_only.py で確認してください")
@@ -286,18 +202,18 @@ def analyze_7days():
     
     recommendations = []
     
-    if not daily_data.empty:
+    if daily.df is not None:
         print(f"\n✅ 基本指標:")
-        print(f"   • 総セッション数: {daily_data['sessions'].sum():,.0f}")
-        print(f"   • アクティブユーザー数: {daily_data['activeUsers'].sum():,.0f}")
-        print(f"   • 総PV数: {daily_data['screenPageViews'].sum():,.0f}")
-        print(f"   • PV/セッション: {daily_data['screenPageViews'].sum() / daily_data['sessions'].sum():.2f}")
+        print(f"   • 総セッション数: {daily.totals['sessions']:,.0f}")
+        print(f"   • アクティブユーザー数: {daily.totals['activeUsers']:,.0f}")
+        print(f"   • 総PV数: {daily.totals['screenPageViews']:,.0f}")
+        print(f"   • PV/セッション: {pages_per_session:.2f}")
         
         recommendations.append("セッション時間が良好です。ユーザーがコンテンツに興味を持っています。")
     
-    if not device_summary.empty:
-        mobile_sessions = device_summary[device_summary['deviceCategory'] == 'mobile']['sessions'].sum()
-        total_device_sessions = device_summary['sessions'].sum()
+    if device.df is not None:
+        mobile_sessions = device.df[device.df['deviceCategory'] == 'mobile']['sessions'].sum()
+        total_device_sessions = device.df['sessions'].sum()
         mobile_rate = (mobile_sessions / total_device_sessions * 100)
         
         print(f"\n📱 デバイス構成:")
@@ -306,8 +222,8 @@ def analyze_7days():
         if mobile_rate > 60:
             recommendations.append("モバイルアクセスが多数を占めています。モバイルUXの最適化を優先してください。")
     
-    if not channel_summary.empty:
-        organic_sessions = channel_summary[channel_summary['sessionDefaultChannelGrouping'] == 'Organic Search']['sessions'].sum()
+    if channel.df is not None:
+        organic_sessions = channel.df[channel.df['sessionDefaultChannelGrouping'] == 'Organic Search']['sessions'].sum()
         
         print(f"\n🔍 流入元:")
         print(f"   • Organic Search: {organic_sessions:,.0f}")
@@ -321,48 +237,40 @@ def analyze_7days():
     print("\n\n9️⃣  レポート保存")
     print("-" * 70)
     
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    os.makedirs('data/processed', exist_ok=True)
+    timestamp = now.strftime('%Y%m%d_%H%M%S')
     
-    # CSV保存
-    if not daily_data.empty:
-        daily_data.to_csv(f'data/processed/daily_trend_7days_{timestamp}.csv', index=False, encoding='utf-8-sig')
-        print(f"✅ 日別トレンド: data/processed/daily_trend_7days_{timestamp}.csv")
-    
-    if not device_summary.empty:
-        device_summary.to_csv(f'data/processed/device_analysis_7days_{timestamp}.csv', index=False, encoding='utf-8-sig')
-        print(f"✅ デバイス別分析: data/processed/device_analysis_7days_{timestamp}.csv")
-    
-    if not channel_summary.empty:
-        channel_summary.to_csv(f'data/processed/channel_analysis_7days_{timestamp}.csv', index=False, encoding='utf-8-sig')
-        print(f"✅ チャネル別分析: data/processed/channel_analysis_7days_{timestamp}.csv")
-    
-    if not page_summary.empty:
-        page_summary.to_csv(f'data/processed/top_pages_7days_{timestamp}.csv', index=False, encoding='utf-8-sig')
-        print(f"✅ 人気ページ: data/processed/top_pages_7days_{timestamp}.csv")
+    # CSV保存（データのないセクションはスキップ）
+    sections = {
+        'daily_trend': ('日別トレンド', daily),
+        'device_analysis': ('デバイス別分析', device),
+        'channel_analysis': ('チャネル別分析', channel),
+        'top_pages': ('人気ページ', page),
+    }
+    csv_files = [
+        (label, section.df, f'data/processed/{name}_7days_{timestamp}.csv')
+        for name, (label, section) in sections.items()
+        if section.df is not None
+    ]
     
     # JSON形式でも保存
     report = {
-        'report_date': datetime.now().isoformat(),
+        'report_date': now.isoformat(),
         'period': '直近7日間',
         'site_url': 'https://isetan.mistore.jp/moodmark',
         'summary': {
-            'total_sessions': int(daily_data['sessions'].sum()) if not daily_data.empty else 0,
-            'active_users': int(daily_data['activeUsers'].sum()) if not daily_data.empty else 0,
-            'total_pageviews': int(daily_data['screenPageViews'].sum()) if not daily_data.empty else 0,
-            'total_conversions': int(daily_data['conversions'].sum()) if not daily_data.empty else 0,
-            'conversion_rate': float((daily_data['conversions'].sum() / daily_data['sessions'].sum() * 100)) if not daily_data.empty else 0,
-            'pages_per_session': float(daily_data['screenPageViews'].sum() / daily_data['sessions'].sum()) if not daily_data.empty else 0
+            'total_sessions': int(daily.totals['sessions']) if daily.df is not None else 0,
+            'active_users': int(daily.totals['activeUsers']) if daily.df is not None else 0,
+            'total_pageviews': int(daily.totals['screenPageViews']) if daily.df is not None else 0,
+            'total_conversions': int(daily.totals['conversions']) if daily.df is not None else 0,
+            'conversion_rate': conversion_rate if daily.df is not None else 0,
+            'pages_per_session': pages_per_session if daily.df is not None else 0
         },
         'recommendations': recommendations,
         'note': '直帰率とセッション時間は両サイトが同じドメイン内にあるため、セッション単位では正確に分離できません。'
     }
     
     report_file = f'data/processed/analysis_report_7days_{timestamp}.json'
-    with open(report_file, 'w', encoding='utf-8') as f:
-        json.dump(report, f, ensure_ascii=False, indent=2)
-    
-    print(f"✅ 統合レポート: {report_file}")
+    write_outputs(csv_files, report, report_file)
     
     print("\n" + "=" * 70)
     print("  分析完了！")
@@ -6,14 +6,27 @@
 
 import sys
 import os
-import json
-import pandas as pd
 from datetime import datetime, timedelta
-from oauth_google_apis import OAuthGoogleAPIsIntegration
+from oauth_google_apis import GA4Query
+from _common import (
+    GA4_CACHE_TTL,
+    MOODMARK_DAILY_QUERY,
+    MOODMARK_DEVICE_QUERY,
+    MOODMARK_CHANNEL_QUERY,
+    get_api_client,
+    write_outputs,
+    Section,
+)
+
+# レポート出力先はインポート時に一度だけ作成する
+os.makedirs('data/processed', exist_ok=True)
 
 def analyze_7days_purchase_only():
     """直近7日間の詳細分析を実行（購入完了のみ）"""
     
+    # ファイル名とレポート日時で同じ時刻を使う
+    now = datetime.now()
+    
     print("\n" + "=" * 70)
     print("  MOO-D MARK サイト分析レポート - 直近7日間")
     print("  https://isetan.mistore.jp/moodmark")
@@ -21,7 +34,7 @@ def analyze_7days_purchase_only():
     print("=" * 70)
     
     # API初期化
-    api = OAuthGoogleAPIsIntegration()
+    api = get_api_client()
     
     if not api.credentials:
         print("\n❌ 認証に失敗しました")
@@ -29,163 +42,127 @@ def analyze_7days_purchase_only():
     
     print("\n📊 データ取得中...\n")
     
+    property_id = "316302380"
+    
+    # 各セクションのGA4リクエストは互いに独立しているため、まとめて並列取得
+    ga4 = api.get_ga4_data_concurrent(
+        {
+            'daily': MOODMARK_DAILY_QUERY,
+            'device': MOODMARK_DEVICE_QUERY,
+            'channel': MOODMARK_CHANNEL_QUERY,
+            'page': GA4Query(['screenPageViews', 'sessions', 'bounceRate'], ['pagePath']),
+            'hourly': GA4Query(['sessions', 'totalUsers', 'ecommercePurchases'], ['hour']),
+        },
+        date_range_days=7,
+        property_id=property_id,
+        cache_ttl=GA4_CACHE_TTL,
+        categorical=True
+    )
+    
     # 1. 日別トレンドデータ（購入完了のみ）
     print("1️⃣  日別トレンド分析（購入完了）")
     print("-" * 70)
     
-    property_id = "316302380"
+    # 各セクションの集計結果（データがなければ df=None のまま）
+    daily, device, channel = Section(), Section(), Section()
     
-    daily_data = api.get_ga4_data(
-        date_range_days=7,
-        metrics=['sessions', 'activeUsers', 'screenPageViews', 'bounceRate', 
-                'averageSessionDuration', 'ecommercePurchases', 'purchaseRevenue'],
-        dimensions=['date', 'landingPage'],
-        property_id=property_id
-    )
+    # moodmarkでランディングしたセッションのみ（moodmarkgiftはAPI側で除外済み）
+    moodmark_data = ga4['daily']
     
-    if not daily_data.empty:
-        # moodmarkでランディングしたセッションのみ（moodmarkgiftを除外）
-        moodmark_data = daily_data[
-            (daily_data['landingPage'].str.contains('/moodmark', na=False)) & 
-            (~daily_data['landingPage'].str.contains('/moodmarkgift/', na=False))
-        ]
+    if not moodmark_data.empty:
+        # GA4側で日別に集計済み
+        daily_data = moodmark_data[['date', 'sessions', 'activeUsers', 'screenPageViews', 'bounceRate',
+                                    'averageSessionDuration', 'ecommercePurchases', 'purchaseRevenue']]
+        daily_data = daily_data.sort_values('date')
+        
+        # 購入完了率（CVR）を計算
+        daily_data['purchase_cvr'] = (daily_data['ecommercePurchases'] / daily_data['sessions'] * 100).round(2)
+        
+        # 7日間の合計は以降のセクションとレポートで使い回す
+        totals = daily_data[['sessions', 'activeUsers', 'screenPageViews',
+                             'ecommercePurchases', 'purchaseRevenue']].sum().to_dict()
+        purchase_cvr = totals['ecommercePurchases'] / totals['sessions'] * 100 if totals['sessions'] > 0 else 0
+        avg_order_value = totals['purchaseRevenue'] / totals['ecommercePurchases'] if totals['ecommercePurchases'] > 0 else 0
+        
+        daily = Section(daily_data, totals)
         
-        if not moodmark_data.empty:
-            daily_data = moodmark_data.groupby('date').agg({
-                'sessions': 'sum',
-                'activeUsers': 'sum',
-                'screenPageViews': 'sum',
-                'bounceRate': 'mean',
-                'averageSessionDuration': 'mean',
-                'ecommercePurchases': 'sum',
-                'purchaseRevenue': 'sum'
-            }).reset_index()
-            
-            daily_data = daily_data.sort_values('date')
-            
-            # 購入完了率（CVR）を計算
-            daily_data['purchase_cvr'] = (daily_data['ecommercePurchases'] / daily_data['sessions'] * 100).round(2)
-        else:
-            print("⚠️ moodmarkのデータが見つかりませんでした")
-            daily_data = pd.DataFrame()
-    else:
-        daily_data = pd.DataFrame()
-    
-    if not daily_data.empty:
         print(daily_data.to_string(index=False))
         
         # 合計値
         print("\n📈 7日間の合計:")
-        print(f"   総セッション数: {daily_data['sessions'].sum():,.0f}")
-        print(f"   アクティブユーザー数: {daily_data['activeUsers'].sum():,.0f}")
-        print(f"   総ページビュー数: {daily_data['screenPageViews'].sum():,.0f}")
-        print(f"   **総購入数（注文完了）: {daily_data['ecommercePurchases'].sum():,.0f}**")
-        print(f"   **総購入額: ¥{daily_data['purchaseRevenue'].sum():,.0f}**")
+        print(f"   総セッション数: {totals['sessions']:,.0f}")
+        print(f"   アクティブユーザー数: {totals['activeUsers']:,.0f}")
+        print(f"   総ページビュー数: {totals['screenPageViews']:,.0f}")
+        print(f"   **総購入数（注文完了）: {totals['ecommercePurchases']:,.0f}**")
+        print(f"   **総購入額: ¥{totals['purchaseRevenue']:,.0f}**")
         
         # 平均値
         print(f"\n📊 7日間の平均:")
         print(f"   平均直帰率: {daily_data['bounceRate'].mean():.1%}")
         print(f"   平均セッション時間: {daily_data['averageSessionDuration'].mean():.0f}秒")
         print(f"   **購入完了率（CVR）: {daily_data['purchase_cvr'].mean():.2f}%**")
-        print(f"   **平均注文単価: ¥{(daily_data['purchaseRevenue'].sum() / daily_data['ecommercePurchases'].sum()):,.0f}**")
+        print(f"   **平均注文単価: ¥{avg_order_value:,.0f}**")
+    else:
+        print("⚠️ moodmarkのデータが見つかりませんでした")
     
     # 2. デバイス別分析（購入完了）
     print("\n\n2️⃣  デバイス別分析（購入完了）")
     print("-" * 70)
     
-    device_data = api.get_ga4_data(
-        date_range_days=7,
-        metrics=['sessions', 'activeUsers', 'bounceRate', 'ecommercePurchases', 'purchaseRevenue'],
-        dimensions=['deviceCategory', 'landingPage'],
-        property_id=property_id
-    )
+    # moodmarkでランディングしたセッションのみ（API側で絞り込み済み）
+    device_data = ga4['device']
     
     if not device_data.empty:
-        # moodmarkでランディングしたセッションのみ
-        moodmark_device_data = device_data[
-            (device_data['landingPage'].str.contains('/moodmark', na=False)) & 
-            (~device_data['landingPage'].str.contains('/moodmarkgift/', na=False))
-        ]
-        
-        if not moodmark_device_data.empty:
-            device_summary = moodmark_device_data.groupby('deviceCategory').agg({
-                'sessions': 'sum',
-                'activeUsers': 'sum',
-                'bounceRate': 'mean',
-                'ecommercePurchases': 'sum',
-                'purchaseRevenue': 'sum'
-            }).reset_index()
+        device_summary = device_data[['deviceCategory', 'sessions', 'activeUsers', 'bounceRate',
+                                      'ecommercePurchases', 'purchaseRevenue']]
+        device_summary = device_summary.sort_values('deviceCategory')
         
         device_summary['purchase_cvr'] = (device_summary['ecommercePurchases'] / device_summary['sessions'] * 100).round(2)
         device_summary['session_share'] = (device_summary['sessions'] / device_summary['sessions'].sum() * 100).round(1)
         device_summary['avg_order_value'] = (device_summary['purchaseRevenue'] / device_summary['ecommercePurchases']).round(0)
         
         print(device_summary.to_string(index=False))
+        device = Section(device_summary)
         
         print("\n💡 デバイス別インサイト:")
-        for _, row in device_summary.iterrows():
-            print(f"\n{row['deviceCategory']}:")
-            print(f"  購入完了数: {row['ecommercePurchases']:,.0f}")
-            print(f"  購入完了率: {row['purchase_cvr']:.2f}%")
-            print(f"  平均注文単価: ¥{row['avg_order_value']:,.0f}")
+        for row in device_summary.itertuples(index=False):
+            print(f"\n{row.deviceCategory}:")
+            print(f"  購入完了数: {row.ecommercePurchases:,.0f}")
+            print(f"  購入完了率: {row.purchase_cvr:.2f}%")
+            print(f"  平均注文単価: ¥{row.avg_order_value:,.0f}")
     
     # 3. チャネル別分析（購入完了）
     print("\n\n3️⃣  チャネル別分析（購入完了）")
     print("-" * 70)
     
-    channel_data = api.get_ga4_data(
-        date_range_days=7,
-        metrics=['sessions', 'activeUsers', 'ecommercePurchases', 'purchaseRevenue'],
-        dimensions=['sessionDefaultChannelGrouping', 'landingPage'],
-        property_id=property_id
-    )
+    # moodmarkでランディングしたセッションのみ（API側で絞り込み済み）
+    channel_data = ga4['channel']
     
     if not channel_data.empty:
-        # moodmarkでランディングしたセッションのみ
-        moodmark_channel_data = channel_data[
-            (channel_data['landingPage'].str.contains('/moodmark', na=False)) & 
-            (~channel_data['landingPage'].str.contains('/moodmarkgift/', na=False))
-        ]
-        
-        if not moodmark_channel_data.empty:
-            channel_summary = moodmark_channel_data.groupby('sessionDefaultChannelGrouping').agg({
-                'sessions': 'sum',
-                'activeUsers': 'sum',
-                'ecommercePurchases': 'sum',
-                'purchaseRevenue': 'sum'
-            }).reset_index()
-        
+        channel_summary = channel_data[['sessionDefaultChannelGrouping', 'sessions', 'activeUsers',
+                                        'ecommercePurchases', 'purchaseRevenue']].copy()
         channel_summary['purchase_cvr'] = (channel_summary['ecommercePurchases'] / channel_summary['sessions'] * 100).round(2)
         channel_summary['avg_order_value'] = (channel_summary['purchaseRevenue'] / channel_summary['ecommercePurchases']).round(0)
         channel_summary = channel_summary.sort_values('ecommercePurchases', ascending=False)
         
         print(channel_summary.to_string(index=False))
+        channel = Section(channel_summary)
         
         print("\n💡 チャネル別パフォーマンス:")
-        for idx, row in channel_summary.head(5).iterrows():
-            print(f"\n{row['sessionDefaultChannelGrouping']}:")
-            print(f"  購入数: {row['ecommercePurchases']:,.0f}")
-            print(f"  購入完了率: {row['purchase_cvr']:.2f}%")
-            print(f"  購入額: ¥{row['purchaseRevenue']:,.0f}")
+        for row in channel_summary.head(5).itertuples(index=False):
+            print(f"\n{row.sessionDefaultChannelGrouping}:")
+            print(f"  購入数: {row.ecommercePurchases:,.0f}")
+            print(f"  購入完了率: {row.purchase_cvr:.2f}%")
+            print(f"  購入額: ¥{row.purchaseRevenue:,.0f}")
     
     # 4. 人気ページ分析
     print("\n\n4️⃣  人気ページ TOP10")
     print("-" * 70)
     
-    page_data = api.get_ga4_data(
-        date_range_days=7,
-        metrics=['screenPageViews', 'sessions', 'bounceRate'],
-        dimensions=['pagePath']
-    )
+    page_data = ga4['page']
     
     if not page_data.empty:
-        page_summary = page_data.groupby('pagePath').agg({
-            'screenPageViews': 'sum',
-            'sessions': 'sum',
-            'bounceRate': 'mean'
-        }).reset_index()
-        
-        page_summary = page_summary.sort_values('screenPageViews', ascending=False).head(10)
+        page_summary = page_data.sort_values('screenPageViews', ascending=False).head(10)
         page_summary['bounceRate'] = page_summary['bounceRate'].apply(lambda x: f"{x:.1%}")
         
         print(page_summary.to_string(index=False))
@@ -194,24 +171,14 @@ def analyze_7days_purchase_only():
     print("\n\n5️⃣  時間帯別アクセス・購入分析")
     print("-" * 70)
     
-    hourly_data = api.get_ga4_data(
-        date_range_days=7,
-        metrics=['sessions', 'totalUsers', 'ecommercePurchases'],
-        dimensions=['dateHour']
-    )
+    hourly_data = ga4['hourly']
     
     if not hourly_data.empty:
-        # 時間を抽出
-        hourly_data['hour'] = hourly_data['dateHour'].astype(str).str[-2:].astype(int)
+        # GA4のhourディメンションは"00"〜"23"の文字列なので一度だけ数値化する
+        hourly_data['hour'] = hourly_data['hour'].astype('int8')
+        hourly_data['purchase_cvr'] = (hourly_data['ecommercePurchases'] / hourly_data['sessions'] * 100).round(2)
         
-        hourly_summary = hourly_data.groupby('hour').agg({
-            'sessions': 'sum',
-            'totalUsers': 'sum',
-            'ecommercePurchases': 'sum'
-        }).reset_index()
-        
-        hourly_summary['purchase_cvr'] = (hourly_summary['ecommercePurchases'] / hourly_summary['sessions'] * 100).round(2)
-        hourly_summary = hourly_summary.sort_values('ecommercePurchases', ascending=False).head(10)
+        hourly_summary = hourly_data.sort_values('ecommercePurchases', ascending=False).head(10)
         
         print("購入が多い時間帯 TOP10:")
         print(hourly_summary.to_string(index=False))
@@ -220,40 +187,26 @@ def analyze_7days_purchase_only():
     print("\n\n6️⃣  購入分析詳細")
     print("-" * 70)
     
-    if not daily_data.empty:
-        total_sessions = daily_data['sessions'].sum()
-        total_purchases = daily_data['ecommercePurchases'].sum()
-        total_revenue = daily_data['purchaseRevenue'].sum()
-        purchase_cvr = (total_purchases / total_sessions * 100)
-        avg_order_value = total_revenue / total_purchases if total_purchases > 0 else 0
-        
+    if daily.df is not None:
         print(f"📊 購入完了の全体サマリー:")
-        print(f"  総セッション数: {total_sessions:,.0f}")
-        print(f"  総購入完了数: {total_purchases:,.0f}")
+        print(f"  総セッション数: {daily.totals['sessions']:,.0f}")
+        print(f"  総購入完了数: {daily.totals['ecommercePurchases']:,.0f}")
         print(f"  **購入完了率（CVR）: {purchase_cvr:.2f}%**")
-        print(f"  総購入額: ¥{total_revenue:,.0f}")
+        print(f"  総購入額: ¥{daily.totals['purchaseRevenue']:,.0f}")
         print(f"  平均注文単価（AOV）: ¥{avg_order_value:,.0f}")
         
         # デバイス別購入完了率
-        if not device_data.empty:
+        if device.df is not None:
             print("\n📱 デバイス別購入完了率:")
-            device_conv = device_data.groupby('deviceCategory').agg({
-                'sessions': 'sum',
-                'ecommercePurchases': 'sum'
-            }).reset_index()
-            device_conv['cvr'] = (device_conv['ecommercePurchases'] / device_conv['sessions'] * 100).round(2)
-            print(device_conv[['deviceCategory', 'ecommercePurchases', 'cvr']].to_string(index=False))
+            device_conv = device.df[['deviceCategory', 'ecommercePurchases', 'purchase_cvr']]
+            print(device_conv.rename(columns={'purchase_cvr': 'cvr'}).to_string(index=False))
         
         # チャネル別購入完了率
-        if not channel_data.empty:
+        if channel.df is not None:
             print("\n🔍 チャネル別購入完了率 TOP5:")
-            channel_conv = channel_data.groupby('sessionDefaultChannelGrouping').agg({
-                'sessions': 'sum',
-                'ecommercePurchases': 'sum'
-            }).reset_index()
-            channel_conv['cvr'] = (channel_conv['ecommercePurchases'] / channel_conv['sessions'] * 100).round(2)
-            channel_conv = channel_conv.sort_values('ecommercePurchases', ascending=False).head(5)
-            print(channel_conv[['sessionDefaultChannelGrouping', 'ecommercePurchases', 'cvr']].to_string(index=False))
+            # channel.df は購入数の降順に並んでいる
+            channel_conv = channel.df[['sessionDefaultChannelGrouping', 'ecommercePurchases', 'purchase_cvr']].head(5)
+            print(channel_conv.rename(columns={'purchase_cvr': 'cvr'}).to_string(index=False))
     
     # 7. 分析サマリーと推奨事項
     print("\n\n7️⃣  分析サマリーと推奨事項")
@@ -261,9 +214,8 @@ def analyze_7days_purchase_only():
     
     recommendations = []
     
-    if not daily_data.empty:
-        avg_purchase_cvr = daily_data['purchase_cvr'].mean()
-        avg_order_value = daily_data['purchaseRevenue'].sum() / daily_data['ecommercePurchases'].sum()
+    if daily.df is not None:
+        avg_purchase_cvr = daily.df['purchase_cvr'].mean()
         
         print(f"\n✅ 購入パフォーマンス:")
         print(f"   • 購入完了率（CVR）: {avg_purchase_cvr:.2f}%")
@@ -283,12 +235,14 @@ def analyze_7days_purchase_only():
         else:
             recommendations.append("平均注文単価が低めです。セット商品やまとめ買い促進施策を強化してください。")
     
-    if not device_data.empty:
-        mobile_purchases = device_summary[device_summary['deviceCategory'] == 'mobile']['ecommercePurchases'].sum()
-        desktop_purchases = device_summary[device_summary['deviceCategory'] == 'desktop']['ecommercePurchases'].sum()
+    if device.df is not None:
+        mobile = device.df[device.df['deviceCategory'] == 'mobile']
+        desktop = device.df[device.df['deviceCategory'] == 'desktop']
+        mobile_purchases = mobile['ecommercePurchases'].sum()
+        desktop_purchases = desktop['ecommercePurchases'].sum()
         
-        mobile_cvr = device_summary[device_summary['deviceCategory'] == 'mobile']['purchase_cvr'].values[0] if len(device_summary[device_summary['deviceCategory'] == 'mobile']) > 0 else 0
-        desktop_cvr = device_summary[device_summary['deviceCategory'] == 'desktop']['purchase_cvr'].values[0] if len(device_summary[device_summary['deviceCategory'] == 'desktop']) > 0 else 0
+        mobile_cvr = mobile['purchase_cvr'].values[0] if len(mobile) > 0 else 0
+        desktop_cvr = desktop['purchase_cvr'].values[0] if len(desktop) > 0 else 0
         
         print(f"\n📱 デバイス別購入:")
         print(f"   • モバイル購入完了率: {mobile_cvr:.2f}%")
@@ -309,48 +263,42 @@ def analyze_7days_purchase_only():
     print("\n\n8️⃣  レポート保存")
     print("-" * 70)
     
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    
-    # CSV保存
-    os.makedirs('data/processed', exist_ok=True)
-    
-    if not daily_data.empty:
-        daily_data.to_csv(f'data/processed/daily_trend_purchase_7days_{timestamp}.csv', index=False, encoding='utf-8-sig')
-        print(f"✅ 日別トレンド: data/processed/daily_trend_purchase_7days_{timestamp}.csv")
+    timestamp = now.strftime('%Y%m%d_%H%M%S')
     
-    if not device_data.empty:
-        device_summary.to_csv(f'data/processed/device_analysis_purchase_7days_{timestamp}.csv', index=False, encoding='utf-8-sig')
-        print(f"✅ デバイス別分析: data/processed/device_analysis_purchase_7days_{timestamp}.csv")
-    
-    if not channel_data.empty:
-        channel_summary.to_csv(f'data/processed/channel_analysis_purchase_7days_{timestamp}.csv', index=False, encoding='utf-8-sig')
-        print(f"✅ チャネル別分析: data/processed/channel_analysis_purchase_7days_{timestamp}.csv")
+    # CSV保存（データのないセクションはスキップ）
+    sections = {
+        'daily_trend': ('日別トレンド', daily),
+        'device_analysis': ('デバイス別分析', device),
+        'channel_analysis': ('チャネル別分析', channel),
+    }
+    csv_files = [
+        (label, section.df, f'data/processed/{name}_purchase_7days_{timestamp}.csv')
+        for name, (label, section) in sections.items()
+        if section.df is not None
+    ]
     
     # JSON形式でも保存
     report = {
-        'report_date': datetime.now().isoformat(),
+        'report_date': now.isoformat(),
         'period': '直近7日間',
         'conversion_definition': '商品の注文（購入）完了のみ',
         'site_url': 'https://isetan.mistore.jp/moodmark',
         'summary': {
-            'total_sessions': int(daily_data['sessions'].sum()) if not daily_data.empty else 0,
-            'total_users': int(daily_data['totalUsers'].sum()) if not daily_data.empty else 0,
-            'total_pageviews': int(daily_data['screenPageViews'].sum()) if not daily_data.empty else 0,
-            'total_purchases': int(daily_data['ecommercePurchases'].sum()) if not daily_data.empty else 0,
-            'total_revenue': float(daily_data['purchaseRevenue'].sum()) if not daily_data.empty else 0,
-            'avg_bounce_rate': float(daily_data['bounceRate'].mean()) if not daily_data.empty else 0,
-            'avg_session_duration': float(daily_data['averageSessionDuration'].mean()) if not daily_data.empty else 0,
-            'purchase_cvr': float((daily_data['ecommercePurchases'].sum() / daily_data['sessions'].sum() * 100)) if not daily_data.empty else 0,
-            'avg_order_value': float(daily_data['purchaseRevenue'].sum() / daily_data['ecommercePurchases'].sum()) if not daily_data.empty and daily_data['ecommercePurchases'].sum() > 0 else 0
+            'total_sessions': int(daily.totals['sessions']) if daily.df is not None else 0,
+            'total_users': int(daily.totals['activeUsers']) if daily.df is not None else 0,
+            'total_pageviews': int(daily.totals['screenPageViews']) if daily.df is not None else 0,
+            'total_purchases': int(daily.totals['ecommercePurchases']) if daily.df is not None else 0,
+            'total_revenue': daily.totals['purchaseRevenue'] if daily.df is not None else 0,
+            'avg_bounce_rate': daily.df['bounceRate'].mean() if daily.df is not None else 0,
+            'avg_session_duration': daily.df['averageSessionDuration'].mean() if daily.df is not None else 0,
+            'purchase_cvr': purchase_cvr if daily.df is not None else 0,
+            'avg_order_value': avg_order_value if daily.df is not None else 0
         },
         'recommendations': recommendations
     }
     
     report_file = f'data/processed/analysis_report_purchase_7days_{timestamp}.json'
-    with open(report_file, 'w', encoding='utf-8') as f:
-        json.dump(report, f, ensure_ascii=False, indent=2)
-    
-    print(f"✅ 統合レポート: {report_file}")
+    write_outputs(csv_files, report, report_file)
     
     print("\n" + "=" * 70)
     print("  分析完了！")
@@ -6,10 +6,21 @@ SEOメディアからECサイトへの送客・コンバージョン貢献を測
 
 import sys
 import os
-import json
 import pandas as pd
 from datetime import datetime, timedelta
-from oauth_google_apis import OAuthGoogleAPIsIntegration
+from oauth_google_apis import GA4Query
+from _common import (
+    GIFT_PATH,
+    GA4Runner,
+    contains_mask,
+    filter_path,
+    save_csv,
+    save_json,
+    site_kind,
+    site_masks,
+    unweight_rates,
+    weight_rates,
+)
 
 def analyze_funnel_contribution():
     """ファネル貢献度の詳細分析"""
@@ -20,14 +31,55 @@ def analyze_funnel_contribution():
     print("=" * 80)
     
     # API初期化
-    api = OAuthGoogleAPIsIntegration()
+    runner = GA4Runner("316302380")
     
-    if not api.credentials:
+    if not runner.authenticated:
         print("\n❌ 認証に失敗しました")
         return
     
     print("\n📊 データ取得中...\n")
-    property_id = "316302380"
+    
+    # 各セクションのGA4リクエストは互いに独立しているため、まとめて並列取得
+    ga4 = runner.fetch(
+        {
+            # 1・5・6・7. ページ別の遷移・流入元・チャネルをまとめた1リクエスト
+            # （各セクションはここから集計する。行数が増えるため取得上限を引き上げる）
+            'page_master': GA4Query(
+                ['sessions', 'screenPageViews', 'conversions'],
+                ['pagePath', 'pageTitle', 'sessionSourceMedium', 'sessionDefaultChannelGrouping'],
+                row_limit=100000
+            ),
+            # 7. ページ別のユーザー数（流入元・チャネル別の行を合計すると同じユーザーを
+            # 組み合わせごとに重複して数えるため、pagePath 単位で別に取得する）
+            'page_users': GA4Query(['totalUsers'], ['pagePath']),
+            # 2. 流入元別のコンバージョン
+            'source_conversion': GA4Query(
+                ['sessions', 'conversions', 'totalUsers'],
+                ['sessionSource', 'sessionMedium', 'pagePath']
+            ),
+            # 3. ランディングページ別の購買貢献度
+            'landing_conversion': GA4Query(['sessions', 'conversions', 'bounceRate'], ['landingPage']),
+            # 4. 初回流入元別の長期的貢献
+            'first_user_analysis': GA4Query(
+                ['totalUsers', 'newUsers', 'conversions', 'sessions'],
+                ['firstUserSource', 'firstUserMedium']
+            ),
+        }
+    )
+    page_master = ga4['page_master']
+    
+    # SEOメディア（moodmarkgift）/ECサイト（moodmark）の判定は各セクション共通のため一度だけ行う
+    if not page_master.empty:
+        page_master['kind'] = site_kind(page_master['pagePath'])
+        is_gift = (page_master['kind'] == 'gift').to_numpy()
+        is_ec = (page_master['kind'] == 'ec').to_numpy()
+        
+        # SEOメディア記事ごとの集計もセクション5・7で共通のため一度だけ行う
+        gift_agg = page_master[is_gift].groupby(['pagePath', 'pageTitle'], as_index=False).agg({
+            'sessions': 'sum',
+            'screenPageViews': 'sum',
+            'conversions': 'sum'
+        })
     
     # ===================================================================
     # 1. SEOメディア訪問後のECサイト訪問分析
@@ -35,29 +87,18 @@ def analyze_funnel_contribution():
     print("1️⃣  SEOメディア→ECサイト 遷移分析")
     print("-" * 80)
     
-    # ユーザーのページ遷移パターンを取得
-    user_journey = api.get_ga4_data(
-        date_range_days=7,
-        metrics=['sessions', 'totalUsers', 'screenPageViews', 'conversions'],
-        dimensions=['pagePath', 'sessionSourceMedium'],
-        property_id=property_id
-    )
-    
-    if not user_journey.empty:
+    if not page_master.empty:
         # moodmarkgift訪問ユーザーを特定
-        gift_users = user_journey[user_journey['pagePath'].str.contains('/moodmarkgift/', na=False)]
+        gift_users = page_master[is_gift]
         
         # その後のmoodmark訪問を確認
-        ec_users = user_journey[
-            (user_journey['pagePath'].str.contains('/moodmark/', na=False)) & 
-            (~user_journey['pagePath'].str.contains('/moodmarkgift/', na=False))
-        ]
+        ec_users = page_master[is_ec]
         
         print(f"📖 SEOメディア訪問セッション: {gift_users['sessions'].sum():,.0f}")
         print(f"🛒 ECサイト訪問セッション: {ec_users['sessions'].sum():,.0f}")
         
         # リファラルを確認
-        referral_from_gift = ec_users[ec_users['sessionSourceMedium'].str.contains('referral', na=False, case=False)]
+        referral_from_gift = ec_users[contains_mask(ec_users['sessionSourceMedium'], 'referral', case=False)]
         if not referral_from_gift.empty:
             print(f"🔗 SEOメディアからのリファラル: {referral_from_gift['sessions'].sum():,.0f}")
     
@@ -67,19 +108,11 @@ def analyze_funnel_contribution():
     print("\n\n2️⃣  流入元別コンバージョン分析")
     print("-" * 80)
     
-    source_conversion = api.get_ga4_data(
-        date_range_days=7,
-        metrics=['sessions', 'conversions', 'totalUsers'],
-        dimensions=['sessionSource', 'sessionMedium', 'pagePath'],
-        property_id=property_id
-    )
+    source_conversion = ga4['source_conversion']
     
     if not source_conversion.empty:
         # ECサイトのコンバージョンのみ
-        ec_conversions = source_conversion[
-            (source_conversion['pagePath'].str.contains('/moodmark/', na=False)) & 
-            (~source_conversion['pagePath'].str.contains('/moodmarkgift/', na=False))
-        ]
+        ec_conversions = source_conversion[site_masks(source_conversion['pagePath'])[1]]
         
         if not ec_conversions.empty:
             source_summary = ec_conversions.groupby(['sessionSource', 'sessionMedium']).agg({
@@ -89,7 +122,7 @@ def analyze_funnel_contribution():
             }).reset_index()
             
             source_summary['cvr'] = (source_summary['conversions'] / source_summary['sessions'] * 100).round(2)
-            source_summary = source_summary.sort_values('conversions', ascending=False).head(10)
+            source_summary = source_summary.nlargest(10, 'conversions')
             
             print("\nECサイトでのコンバージョン上位流入元:")
             print(source_summary.to_string(index=False))
@@ -100,34 +133,33 @@ def analyze_funnel_contribution():
     print("\n\n3️⃣  ランディングページ別の購買貢献度")
     print("-" * 80)
     
-    landing_conversion = api.get_ga4_data(
-        date_range_days=7,
-        metrics=['sessions', 'conversions', 'bounceRate'],
-        dimensions=['landingPage', 'firstUserSource'],
-        property_id=property_id
-    )
+    # SEOメディアがランディングページのセッション
+    gift_landing = filter_path(ga4['landing_conversion'], GIFT_PATH, column='landingPage')
     
-    if not landing_conversion.empty:
-        # SEOメディアがランディングページのセッション
-        gift_landing = landing_conversion[
-            landing_conversion['landingPage'].str.contains('/moodmarkgift/', na=False)
-        ]
+    if not gift_landing.empty:
+        landing_summary = weight_rates(gift_landing, ['bounceRate']).groupby('landingPage').agg({
+            'sessions': 'sum',
+            'conversions': 'sum',
+            'bounceRate': 'sum'
+        }).reset_index()
+        landing_summary = unweight_rates(landing_summary, ['bounceRate'])
         
-        if not gift_landing.empty:
-            landing_summary = gift_landing.groupby('landingPage').agg({
-                'sessions': 'sum',
-                'conversions': 'sum',
-                'bounceRate': 'mean'
-            }).reset_index()
-            
-            landing_summary['cvr'] = (landing_summary['conversions'] / landing_summary['sessions'] * 100).round(2)
-            landing_summary = landing_summary.sort_values('sessions', ascending=False).head(15)
-            
-            print("\nSEOメディア記事別の送客パフォーマンス:")
-            for idx, row in landing_summary.iterrows():
-                article_name = row['landingPage'].split('/')[-1] if row['landingPage'] else 'トップ'
-                print(f"\n記事ID: {article_name}")
-                print(f"  セッション: {row['sessions']:,.0f} | CV: {row['conversions']:,.0f} | CVR: {row['cvr']:.2f}% | 直帰率: {row['bounceRate']:.1%}")
+        landing_summary['cvr'] = (landing_summary['conversions'] / landing_summary['sessions'] * 100).round(2)
+        landing_summary = landing_summary.nlargest(15, 'sessions')
+        
+        print("\nSEOメディア記事別の送客パフォーマンス:")
+        landing_summary['article_id'] = (
+            landing_summary['landingPage'].str.rsplit('/', n=1).str[-1]
+            .mask(landing_summary['landingPage'] == '', 'トップ')
+        )
+        lines = (
+            "\n記事ID: " + landing_summary['article_id']
+            + "\n  セッション: " + landing_summary['sessions'].map('{:,.0f}'.format)
+            + " | CV: " + landing_summary['conversions'].map('{:,.0f}'.format)
+            + " | CVR: " + landing_summary['cvr'].map('{:.2f}%'.format)
+            + " | 直帰率: " + landing_summary['bounceRate'].map('{:.1%}'.format)
+        )
+        print('\n'.join(lines))
     
     # ===================================================================
     # 4. 初回流入元別の長期的貢献分析
@@ -135,12 +167,7 @@ def analyze_funnel_contribution():
     print("\n\n4️⃣  初回流入元別の長期的貢献度")
     print("-" * 80)
     
-    first_user_analysis = api.get_ga4_data(
-        date_range_days=7,
-        metrics=['totalUsers', 'newUsers', 'conversions', 'sessions'],
-        dimensions=['firstUserSource', 'firstUserMedium'],
-        property_id=property_id
-    )
+    first_user_analysis = ga4['first_user_analysis']
     
     if not first_user_analysis.empty:
         first_user_summary = first_user_analysis.groupby(['firstUserSource', 'firstUserMedium']).agg({
@@ -153,7 +180,7 @@ def analyze_funnel_contribution():
         first_user_summary['conversion_per_user'] = (
             first_user_summary['conversions'] / first_user_summary['totalUsers']
         ).round(2)
-        first_user_summary = first_user_summary.sort_values('conversions', ascending=False).head(10)
+        first_user_summary = first_user_summary.nlargest(10, 'conversions')
         
         print("\n初回流入元別のユーザー価値:")
         print(first_user_summary.to_string(index=False))
@@ -164,42 +191,32 @@ def analyze_funnel_contribution():
     print("\n\n5️⃣  SEOメディア記事のEC送客力ランキング")
     print("-" * 80)
     
-    # ページパスでECサイトとSEOメディアの遷移を追跡
-    page_transitions = api.get_ga4_data(
-        date_range_days=7,
-        metrics=['sessions', 'screenPageViews', 'conversions'],
-        dimensions=['pagePath', 'pageTitle'],
-        property_id=property_id
-    )
-    
-    if not page_transitions.empty:
+    gift_page_summary = pd.DataFrame()
+    if not page_master.empty:
         # SEOメディアのページのみ
-        gift_pages = page_transitions[
-            page_transitions['pagePath'].str.contains('/moodmarkgift/', na=False)
-        ]
-        
-        if not gift_pages.empty:
-            gift_page_summary = gift_pages.groupby(['pagePath', 'pageTitle']).agg({
-                'sessions': 'sum',
-                'screenPageViews': 'sum',
-                'conversions': 'sum'
-            }).reset_index()
+        if not gift_agg.empty:
+            gift_page_summary = gift_agg[['pagePath', 'pageTitle', 'sessions', 'screenPageViews', 'conversions']].copy()
             
             gift_page_summary['conversion_rate'] = (
                 gift_page_summary['conversions'] / gift_page_summary['sessions'] * 100
             ).round(2)
             
             # EC送客力が高い順にソート（コンバージョン数）
-            gift_page_summary = gift_page_summary.sort_values('conversions', ascending=False).head(20)
+            gift_page_summary = gift_page_summary.nlargest(20, 'conversions')
             
             print("\nEC送客力が高いSEOメディア記事 TOP20:")
             print("（コンバージョン数でランキング）\n")
             
-            for idx, row in gift_page_summary.iterrows():
-                print(f"{idx+1}. {row['pageTitle']}")
-                print(f"   セッション: {row['sessions']:,.0f} | PV: {row['screenPageViews']:,.0f}")
-                print(f"   コンバージョン: {row['conversions']:,.0f} | CVR: {row['conversion_rate']:.2f}%")
-                print()
+            ranks = pd.Series(range(1, len(gift_page_summary) + 1), index=gift_page_summary.index).astype(str)
+            lines = (
+                ranks + ". " + gift_page_summary['pageTitle'].astype(str)
+                + "\n   セッション: " + gift_page_summary['sessions'].map('{:,.0f}'.format)
+                + " | PV: " + gift_page_summary['screenPageViews'].map('{:,.0f}'.format)
+                + "\n   コンバージョン: " + gift_page_summary['conversions'].map('{:,.0f}'.format)
+                + " | CVR: " + gift_page_summary['conversion_rate'].map('{:.2f}%'.format)
+                + "\n"
+            )
+            print('\n'.join(lines))
     
     # ===================================================================
     # 6. カスタマージャーニー分析
@@ -207,25 +224,12 @@ def analyze_funnel_contribution():
     print("\n\n6️⃣  カスタマージャーニーパターン分析")
     print("-" * 80)
     
-    # セッション内のページ遷移を分析
-    journey_data = api.get_ga4_data(
-        date_range_days=7,
-        metrics=['sessions', 'conversions', 'engagementRate'],
-        dimensions=['pagePath', 'sessionDefaultChannelGrouping'],
-        property_id=property_id
-    )
-    
-    if not journey_data.empty:
+    if not page_master.empty:
         # パターン1: SEOメディアから始まるジャーニー
-        seo_journey = journey_data[
-            journey_data['sessionDefaultChannelGrouping'] == 'Organic Search'
-        ]
+        is_organic = (page_master['sessionDefaultChannelGrouping'] == 'Organic Search').to_numpy()
         
-        gift_seo = seo_journey[seo_journey['pagePath'].str.contains('/moodmarkgift/', na=False)]
-        ec_seo = seo_journey[
-            (seo_journey['pagePath'].str.contains('/moodmark/', na=False)) &
-            (~seo_journey['pagePath'].str.contains('/moodmarkgift/', na=False))
-        ]
+        gift_seo = page_master[is_organic & is_gift]
+        ec_seo = page_master[is_organic & is_ec]
         
         print("\n自然検索経由のジャーニー:")
         print(f"  SEOメディア訪問: {gift_seo['sessions'].sum():,.0f} セッション")
@@ -239,37 +243,31 @@ def analyze_funnel_contribution():
     print("\n\n7️⃣  SEOメディアの貢献度サマリー")
     print("-" * 80)
     
-    # 全体のデータから計算
-    all_data = api.get_ga4_data(
-        date_range_days=7,
-        metrics=['sessions', 'totalUsers', 'conversions', 'screenPageViews'],
-        dimensions=['pagePath'],
-        property_id=property_id
-    )
+    # データがない場合もレポートと推奨事項の判定で参照するため0で初期化
+    total_sessions = total_conversions = 0
+    gift_sessions = gift_conversions = 0
+    ec_sessions = ec_conversions = 0
     
-    if not all_data.empty:
-        # SEOメディアのデータ
-        gift_data = all_data[all_data['pagePath'].str.contains('/moodmarkgift/', na=False)]
+    if not page_master.empty:
+        # サイト種別（gift / ec / other）ごとの合計を1回の集計で求める
+        site_totals = page_master.groupby('kind', observed=False)[['sessions', 'conversions']].sum()
         
-        # ECサイトのデータ
-        ec_data = all_data[
-            (all_data['pagePath'].str.contains('/moodmark/', na=False)) &
-            (~all_data['pagePath'].str.contains('/moodmarkgift/', na=False))
-        ]
+        # ユーザー数は pagePath 単位の取得結果から集計する
+        page_users = ga4['page_users']
+        gift_users = ec_users = 0
+        if not page_users.empty:
+            user_totals = page_users['totalUsers'].groupby(site_kind(page_users['pagePath']), observed=False).sum()
+            gift_users, ec_users = user_totals['gift'], user_totals['ec']
         
         # 全体
-        total_sessions = all_data['sessions'].sum()
-        total_conversions = all_data['conversions'].sum()
+        total_sessions = site_totals['sessions'].sum()
+        total_conversions = site_totals['conversions'].sum()
         
         # SEOメディア
-        gift_sessions = gift_data['sessions'].sum()
-        gift_conversions = gift_data['conversions'].sum()
-        gift_users = gift_data['totalUsers'].sum()
+        gift_sessions, gift_conversions = site_totals.loc['gift']
         
         # ECサイト
-        ec_sessions = ec_data['sessions'].sum()
-        ec_conversions = ec_data['conversions'].sum()
-        ec_users = ec_data['totalUsers'].sum()
+        ec_sessions, ec_conversions = site_totals.loc['ec']
         
         print("\n📊 全体サマリー:")
         print(f"  総セッション数: {total_sessions:,.0f}")
@@ -304,42 +302,28 @@ def analyze_funnel_contribution():
     recommendations = []
     
     if gift_sessions > 0 and ec_sessions > 0:
-        gift_ratio = gift_sessions / total_sessions
         gift_cv_ratio = gift_conversions / total_conversions if total_conversions > 0 else 0
         
-        print("\n💡 分析結果に基づく推奨事項:\n")
-        
-        # 1. SEOメディアの直接コンバージョンが低い場合
-        if gift_cv_ratio < 0.1:
-            rec = "SEOメディア記事内にEC商品リンクを明確に配置し、直接購入への導線を強化"
-            recommendations.append(rec)
-            print(f"1. {rec}")
-        
-        # 2. セッション数は多いがCVが少ない
-        if gift_sessions > ec_sessions * 0.3 and gift_cv_ratio < 0.2:
-            rec = "記事末尾に「この記事で紹介した商品はこちら」セクションを追加"
-            recommendations.append(rec)
-            print(f"2. {rec}")
-        
-        # 3. 遷移率改善
-        rec = "SEOメディアトップページからECサイトへの導線を強化"
-        recommendations.append(rec)
-        print(f"3. {rec}")
-        
-        # 4. トラッキング強化
-        rec = "クロスドメイントラッキングを実装し、正確なファネル測定を実現"
-        recommendations.append(rec)
-        print(f"4. {rec}")
-        
-        # 5. コンテンツ戦略
-        rec = "EC売上データと連携し、売れ筋商品をSEOメディアで特集"
-        recommendations.append(rec)
-        print(f"5. {rec}")
+        # (適用条件, 推奨事項) の表。条件を満たすものを上から順に採用する
+        rules = [
+            # SEOメディアの直接コンバージョンが低い場合
+            (gift_cv_ratio < 0.1, "SEOメディア記事内にEC商品リンクを明確に配置し、直接購入への導線を強化"),
+            # セッション数は多いがCVが少ない
+            (gift_sessions > ec_sessions * 0.3 and gift_cv_ratio < 0.2,
+             "記事末尾に「この記事で紹介した商品はこちら」セクションを追加"),
+            # 遷移率改善
+            (True, "SEOメディアトップページからECサイトへの導線を強化"),
+            # トラッキング強化
+            (True, "クロスドメイントラッキングを実装し、正確なファネル測定を実現"),
+            # コンテンツ戦略
+            (True, "EC売上データと連携し、売れ筋商品をSEOメディアで特集"),
+            # リターゲティング
+            (True, "SEOメディア訪問者へのリターゲティング広告でEC送客を促進"),
+        ]
+        recommendations = [rec for applies, rec in rules if applies]
         
-        # 6. リターゲティング
-        rec = "SEOメディア訪問者へのリターゲティング広告でEC送客を促進"
-        recommendations.append(rec)
-        print(f"6. {rec}")
+        print("\n💡 分析結果に基づく推奨事項:\n")
+        print('\n'.join(f"{i}. {rec}" for i, rec in enumerate(recommendations, 1)))
     
     # ===================================================================
     # 9. レポート保存
@@ -356,31 +340,27 @@ def analyze_funnel_contribution():
         'period': '直近7日間',
         'analysis_type': 'ファネル貢献度分析',
         'summary': {
-            'total_sessions': int(total_sessions) if 'total_sessions' in locals() else 0,
-            'gift_sessions': int(gift_sessions) if 'gift_sessions' in locals() else 0,
-            'ec_sessions': int(ec_sessions) if 'ec_sessions' in locals() else 0,
-            'gift_conversions': int(gift_conversions) if 'gift_conversions' in locals() else 0,
-            'ec_conversions': int(ec_conversions) if 'ec_conversions' in locals() else 0,
-            'gift_session_share': float(gift_sessions/total_sessions*100) if 'gift_sessions' in locals() and total_sessions > 0 else 0,
-            'gift_conversion_share': float(gift_conversions/total_conversions*100) if 'gift_conversions' in locals() and total_conversions > 0 else 0
+            'total_sessions': int(total_sessions),
+            'gift_sessions': int(gift_sessions),
+            'ec_sessions': int(ec_sessions),
+            'gift_conversions': int(gift_conversions),
+            'ec_conversions': int(ec_conversions),
+            'gift_session_share': gift_sessions / total_sessions * 100 if total_sessions > 0 else 0,
+            'gift_conversion_share': gift_conversions / total_conversions * 100 if total_conversions > 0 else 0
         },
         'recommendations': recommendations
     }
     
     report_file = f'data/processed/funnel_analysis_report_{timestamp}.json'
-    with open(report_file, 'w', encoding='utf-8') as f:
-        json.dump(funnel_report, f, ensure_ascii=False, indent=2)
+    save_json(funnel_report, report_file)
     
     print(f"✅ ファネル分析レポート: {report_file}")
     
     # CSVデータも保存
     if not gift_page_summary.empty:
-        gift_page_summary.to_csv(
-            f'data/processed/gift_article_performance_{timestamp}.csv',
-            index=False,
-            encoding='utf-8-sig'
-        )
-        print(f"✅ 記事別パフォーマンス: data/processed/gift_article_performance_{timestamp}.csv")
+        article_file = f'data/processed/gift_article_performance_{timestamp}.csv'
+        save_csv(gift_page_summary, article_file)
+        print(f"✅ 記事別パフォーマンス: {article_file}")
     
     print("\n" + "=" * 80)
     print("  ファネル貢献度分析完了！")
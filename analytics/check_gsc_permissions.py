@@ -7,61 +7,133 @@ GSC権限確認スクリプト
 
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 import logging
 
+from _common import thread_http
+
 # ログ設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# OAuthトークンファイルと要求スコープ（_get_credentials / _get_service のキャッシュキーになる）
+TOKEN_PATH = 'config/token.json'
+GSC_SCOPES = ('https://www.googleapis.com/auth/webmasters.readonly',)
+
+# 一時的なエラー（429/5xx、レート制限の403、通信エラー）の再試行回数。
+# googleapiclient の execute(num_retries=...) が指数バックオフ（ランダム化あり）で再試行する
+NUM_RETRIES = 2
+
+# データアクセステスト用の簡単なリクエスト（全サイト共通、変更しないこと）
+GSC_PROBE_BODY = {
+    'startDate': '2025-10-01',
+    'endDate': '2025-10-01',
+    'dimensions': ['date'],
+    'rowLimit': 1
+}
+
+@lru_cache(maxsize=None)
+def _get_credentials(token_path, scopes):
+    """
+    OAuthトークンを読み込む（同一引数では読み込み済みのものを再利用）
+    
+    期限切れの場合は並列リクエストの前に一度だけリフレッシュする。
+    token.json は oauth_google_apis と共有しており、ここでのスコープは絞り込んでいるため書き戻さない。
+    """
+    credentials = Credentials.from_authorized_user_file(token_path, scopes=list(scopes))
+    if not credentials.valid and credentials.refresh_token:
+        credentials.refresh(Request())
+    return credentials
+
+@lru_cache(maxsize=None)
+def _get_service(api, version, scopes, token_path):
+    """
+    APIサービスを構築（同一引数では構築済みのものを再利用）
+    
+    build() はディスカバリドキュメントの取得・解析とHTTPクライアント生成を伴うため、
+    関数ごとに作り直さず使い回す。
+    """
+    credentials = _get_credentials(token_path, scopes)
+    return build(api, version, credentials=credentials, cache_discovery=False)
+
 def check_gsc_sites():
-    """GSCサイトの権限確認"""
+    """
+    GSCサイトの権限確認
+    
+    Returns:
+        set: アクセス可能なサイトURL（一覧を取得できなかった場合はNone）
+    """
+    lines = []
+    accessible_sites = None
     try:
         # OAuth認証でGSC APIサービス構築
-        token_path = 'config/token.json'
-        if not os.path.exists(token_path):
+        if not os.path.exists(TOKEN_PATH):
             logger.error("OAuthトークンファイルが見つかりません")
             return
         
-        credentials = Credentials.from_authorized_user_file(
-            token_path, 
-            scopes=['https://www.googleapis.com/auth/webmasters.readonly']
-        )
-        
-        service = build('searchconsole', 'v1', credentials=credentials)
+        service = _get_service('searchconsole', 'v1', GSC_SCOPES, TOKEN_PATH)
         
         # サイト一覧取得
-        sites = service.sites().list().execute()
+        sites = service.sites().list().execute(num_retries=NUM_RETRIES)
+        
+        accessible_sites = {site['siteUrl'] for site in sites.get('siteEntry', []) if 'siteUrl' in site}
         
-        print("=== GSC サイト一覧 ===")
+        lines.append("=== GSC サイト一覧 ===")
         if 'siteEntry' in sites:
             for site in sites['siteEntry']:
-                print(f"サイトURL: {site.get('siteUrl', 'N/A')}")
-                print(f"権限レベル: {site.get('permissionLevel', 'N/A')}")
-                print("---")
+                lines.append(f"サイトURL: {site.get('siteUrl', 'N/A')}")
+                lines.append(f"権限レベル: {site.get('permissionLevel', 'N/A')}")
+                lines.append("---")
         else:
-            print("サイトが見つかりません")
+            lines.append("サイトが見つかりません")
             
     except Exception as e:
         logger.error(f"GSCサイト確認エラー: {e}")
+    
+    if lines:
+        print('\n'.join(lines))
+    return accessible_sites
 
-def test_gsc_data_access():
-    """GSCデータアクセステスト"""
+def _probe_site(credentials, service, site_url):
+    """
+    1サイト分のGSCデータアクセスを試行
+    
+    並列実行されるため、サービスが持つHTTPクライアントではなくスレッド専用のものを使う。
+    
+    Returns:
+        tuple: (サイトURL, 成功したか, レスポンスまたは例外)
+    """
+    try:
+        response = service.searchanalytics().query(
+            siteUrl=site_url,
+            body=GSC_PROBE_BODY
+        ).execute(http=thread_http(credentials), num_retries=NUM_RETRIES)
+        return site_url, True, response
+    except Exception as e:
+        return site_url, False, e
+
+def test_gsc_data_access(accessible_sites=None):
+    """
+    GSCデータアクセステスト
+    
+    Args:
+        accessible_sites (set): check_gsc_sites で取得したアクセス可能なサイトURL。
+            指定した場合、含まれないサイトは権限がないことが確定しているためリクエストしない
+    """
+    lines = []
     try:
         # OAuth認証でGSC APIサービス構築
-        token_path = 'config/token.json'
-        if not os.path.exists(token_path):
+        if not os.path.exists(TOKEN_PATH):
             logger.error("OAuthトークンファイルが見つかりません")
             return
         
-        credentials = Credentials.from_authorized_user_file(
-            token_path, 
-            scopes=['https://www.googleapis.com/auth/webmasters.readonly']
-        )
-        
-        service = build('searchconsole', 'v1', credentials=credentials)
+        credentials = _get_credentials(TOKEN_PATH, GSC_SCOPES)
+        service = _get_service('searchconsole', 'v1', GSC_SCOPES, TOKEN_PATH)
         
         # テスト対象サイト
         test_sites = [
@@ -70,40 +142,43 @@ def test_gsc_data_access():
             'https://isetan.mistore.jp/moodmarkgift/'
         ]
         
+        probe_sites = [
+            url for url in test_sites
+            if accessible_sites is None or url in accessible_sites
+        ]
+        
+        # 各サイトへのリクエストは独立しているため並列に発行し、結果はサイト順に表示する
+        results = {}
+        if probe_sites:
+            with ThreadPoolExecutor(max_workers=len(probe_sites)) as ex:
+                for site_url, ok, payload in ex.map(lambda url: _probe_site(credentials, service, url), probe_sites):
+                    results[site_url] = (ok, payload)
+        
         for site_url in test_sites:
-            try:
-                # 簡単なリクエスト
-                request = {
-                    'startDate': '2025-10-01',
-                    'endDate': '2025-10-01',
-                    'dimensions': ['date'],
-                    'rowLimit': 1
-                }
-                
-                response = service.searchanalytics().query(
-                    siteUrl=site_url,
-                    body=request
-                ).execute()
-                
-                print(f"=== GSC データアクセステスト (サイトURL: {site_url}) ===")
-                print("✅ アクセス成功")
-                if 'rows' in response:
-                    print(f"データ行数: {len(response['rows'])}")
+            lines.append(f"=== GSC データアクセステスト (サイトURL: {site_url}) ===")
+            if site_url not in results:
+                lines.append("⚠️ サイト一覧に含まれないためスキップ（権限なし）")
+                lines.append("")
+                continue
+            
+            ok, payload = results[site_url]
+            if ok:
+                lines.append("✅ アクセス成功")
+                if 'rows' in payload:
+                    lines.append(f"データ行数: {len(payload['rows'])}")
                 else:
-                    print("データ行なし")
-                print()
-                
-            except HttpError as e:
-                print(f"=== GSC データアクセステスト (サイトURL: {site_url}) ===")
-                print(f"❌ アクセス失敗: {e}")
-                print()
-            except Exception as e:
-                print(f"=== GSC データアクセステスト (サイトURL: {site_url}) ===")
-                print(f"❌ エラー: {e}")
-                print()
+                    lines.append("データ行なし")
+            elif isinstance(payload, HttpError):
+                lines.append(f"❌ アクセス失敗: {payload}")
+            else:
+                lines.append(f"❌ エラー: {payload}")
+            lines.append("")
             
     except Exception as e:
         logger.error(f"GSCデータアクセステストエラー: {e}")
+    
+    if lines:
+        print('\n'.join(lines))
 
 def main():
     """メイン実行関数"""
@@ -111,11 +186,11 @@ def main():
     print("nakamura@likepass.netのGSC権限を確認します\n")
     
     # GSCサイト確認
-    check_gsc_sites()
+    accessible_sites = check_gsc_sites()
     print()
     
-    # GSCデータアクセステスト
-    test_gsc_data_access()
+    # GSCデータアクセステスト（サイト一覧にないサイトはリクエストしない）
+    test_gsc_data_access(accessible_sites)
 
 if __name__ == "__main__":
     main()
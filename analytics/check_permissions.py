@@ -8,174 +8,257 @@
 
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from google.auth.transport.requests import Request
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from googleapiclient.model import JsonModel
 import logging
 
+from _common import thread_http
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # ログ設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 認証ファイル・設定ファイルと要求スコープ（スコープは _get_credentials / _get_service のキャッシュキーになる）
+CREDENTIALS_FILE = 'config/google-credentials.json'
+CONFIG_FILE = 'config/analytics_config.json'
+GA4_SCOPES = ('https://www.googleapis.com/auth/analytics.readonly',)
+GSC_SCOPES = ('https://www.googleapis.com/auth/webmasters.readonly',)
+
+# 一時的なエラー（429/5xx、レート制限の403、通信エラー）の再試行回数。
+# googleapiclient の execute(num_retries=...) が指数バックオフ（ランダム化あり）で再試行する
+NUM_RETRIES = 2
+
+# データアクセステスト用の簡単なリクエスト（全サイト・プロパティ共通、変更しないこと）
+GA4_PROBE_REPORT = {
+    'dateRanges': [{'startDate': '2025-10-01', 'endDate': '2025-10-01'}],
+    'metrics': [{'name': 'sessions'}],
+    'dimensions': [{'name': 'date'}],
+    'limit': 1
+}
+GSC_PROBE_BODY = {
+    'startDate': '2025-10-01',
+    'endDate': '2025-10-01',
+    'dimensions': ['date'],
+    'rowLimit': 1
+}
+
+# 1回のバッチリクエストに含められるAPI呼び出し数の上限
+BATCH_LIMIT = 50
+
+class _OrjsonModel(JsonModel):
+    """
+    レスポンスのJSONをorjsonでデコードするJsonModel
+    
+    GA4 Adminのアカウント・プロパティ一覧などの大きなレスポンスの解析を速くする。
+    orjsonがない場合や解析できない場合は標準のJsonModelにフォールバックする。
+    """
+    
+    def deserialize(self, content):
+        if orjson is None:
+            return super().deserialize(content)
+        try:
+            body = orjson.loads(content)
+        except orjson.JSONDecodeError:
+            return super().deserialize(content)
+        if self._data_wrapper and 'data' in body:
+            body = body['data']
+        return body
+
+@lru_cache(maxsize=None)
+def _get_credentials(credentials_file, scopes):
+    """
+    サービスアカウント認証情報を読み込む（同一引数では読み込み済みのものを再利用）
+    
+    並列実行される各リクエストがそれぞれトークンを取得しないよう、ここで一度だけ取得しておく。
+    """
+    credentials = service_account.Credentials.from_service_account_file(credentials_file, scopes=list(scopes))
+    credentials.refresh(Request())
+    return credentials
+
+@lru_cache(maxsize=None)
+def _get_service(api, version, scopes, credentials_file):
+    """
+    APIサービスを構築（同一引数では構築済みのものを再利用）
+    
+    build() はディスカバリドキュメントの取得・解析とHTTPクライアント生成を伴うため、
+    関数ごとに作り直さず使い回す。
+    """
+    credentials = _get_credentials(credentials_file, scopes)
+    return build(api, version, credentials=credentials, cache_discovery=False, model=_OrjsonModel())
+
 def check_ga4_properties(credentials_file):
     """利用可能なGA4プロパティを確認"""
+    lines = []
     try:
-        credentials = service_account.Credentials.from_service_account_file(
-            credentials_file,
-            scopes=['https://www.googleapis.com/auth/analytics.readonly']
-        )
-        
         # GA4 Admin APIサービス構築
-        service = build('analyticsadmin', 'v1beta', credentials=credentials)
+        service = _get_service('analyticsadmin', 'v1beta', GA4_SCOPES, credentials_file)
         
         # アカウント一覧取得
-        accounts = service.accounts().list().execute()
+        accounts = service.accounts().list().execute(num_retries=NUM_RETRIES)
         
-        print("=== GA4 アカウント一覧 ===")
+        lines.append("=== GA4 アカウント一覧 ===")
         if 'accounts' in accounts:
-            for account in accounts['accounts']:
-                print(f"アカウント名: {account.get('displayName', 'N/A')}")
-                print(f"アカウントID: {account.get('name', 'N/A')}")
-                print(f"作成日: {account.get('createTime', 'N/A')}")
-                print("---")
+            # アカウントごとのプロパティ一覧取得を1回のHTTPバッチにまとめる
+            # （アカウント名 -> レスポンスまたは例外）
+            account_properties = {}
+            
+            def _on_properties(request_id, response, exception):
+                account_properties[request_id] = exception if exception is not None else response
+            
+            account_list = accounts['accounts']
+            for start in range(0, len(account_list), BATCH_LIMIT):
+                batch = service.new_batch_http_request(callback=_on_properties)
+                for account in account_list[start:start + BATCH_LIMIT]:
+                    account_id = account['name'].rpartition('/')[2]
+                    batch.add(
+                        service.accounts().properties().list(parent=f"accounts/{account_id}"),
+                        request_id=account['name']
+                    )
+                batch.execute()
+            
+            for account in account_list:
+                lines.append(f"アカウント名: {account.get('displayName', 'N/A')}")
+                lines.append(f"アカウントID: {account.get('name', 'N/A')}")
+                lines.append(f"作成日: {account.get('createTime', 'N/A')}")
+                lines.append("---")
                 
-                # プロパティ一覧取得
-                account_id = account['name'].split('/')[-1]
-                try:
-                    properties = service.accounts().properties().list(
-                        parent=f"accounts/{account_id}"
-                    ).execute()
-                    
-                    if 'properties' in properties:
-                        print("プロパティ一覧:")
-                        for prop in properties['properties']:
-                            print(f"  - プロパティ名: {prop.get('displayName', 'N/A')}")
-                            print(f"    プロパティID: {prop.get('name', 'N/A')}")
-                            print(f"    作成日: {prop.get('createTime', 'N/A')}")
-                            print()
-                except HttpError as e:
-                    print(f"  プロパティ取得エラー: {e}")
-                    print()
+                # プロパティ一覧（バッチで取得済み）
+                properties = account_properties.get(account['name'], {})
+                if isinstance(properties, Exception):
+                    lines.append(f"  プロパティ取得エラー: {properties}")
+                    lines.append("")
+                elif 'properties' in properties:
+                    lines.append("プロパティ一覧:")
+                    for prop in properties['properties']:
+                        lines.append(f"  - プロパティ名: {prop.get('displayName', 'N/A')}")
+                        lines.append(f"    プロパティID: {prop.get('name', 'N/A')}")
+                        lines.append(f"    作成日: {prop.get('createTime', 'N/A')}")
+                        lines.append("")
         else:
-            print("アカウントが見つかりません")
+            lines.append("アカウントが見つかりません")
             
     except Exception as e:
         logger.error(f"GA4プロパティ確認エラー: {e}")
+    
+    if lines:
+        print('\n'.join(lines))
 
 def check_gsc_sites(credentials_file):
     """利用可能なGSCサイトを確認"""
+    lines = []
     try:
-        credentials = service_account.Credentials.from_service_account_file(
-            credentials_file,
-            scopes=['https://www.googleapis.com/auth/webmasters.readonly']
-        )
-        
         # GSC APIサービス構築
-        service = build('searchconsole', 'v1', credentials=credentials)
+        service = _get_service('searchconsole', 'v1', GSC_SCOPES, credentials_file)
         
         # サイト一覧取得
-        sites = service.sites().list().execute()
+        sites = service.sites().list().execute(num_retries=NUM_RETRIES)
         
-        print("=== GSC サイト一覧 ===")
+        lines.append("=== GSC サイト一覧 ===")
         if 'siteEntry' in sites:
             for site in sites['siteEntry']:
-                print(f"サイトURL: {site.get('siteUrl', 'N/A')}")
-                print(f"権限レベル: {site.get('permissionLevel', 'N/A')}")
-                print("---")
+                lines.append(f"サイトURL: {site.get('siteUrl', 'N/A')}")
+                lines.append(f"権限レベル: {site.get('permissionLevel', 'N/A')}")
+                lines.append("---")
         else:
-            print("サイトが見つかりません")
+            lines.append("サイトが見つかりません")
             
     except Exception as e:
         logger.error(f"GSCサイト確認エラー: {e}")
+    
+    if lines:
+        print('\n'.join(lines))
 
 def test_ga4_data_access(credentials_file, property_id):
-    """GA4データアクセステスト"""
+    """
+    GA4データアクセステスト
+    
+    並列実行しても出力が混ざらないよう、表示内容は行のリストとして返す。
+    
+    Returns:
+        list: 表示する行
+    """
+    lines = [f"=== GA4 データアクセステスト (プロパティID: {property_id}) ==="]
     try:
-        credentials = service_account.Credentials.from_service_account_file(
-            credentials_file,
-            scopes=['https://www.googleapis.com/auth/analytics.readonly']
-        )
-        
-        # GA4 Data APIサービス構築
-        service = build('analyticsdata', 'v1beta', credentials=credentials)
+        # GA4 Data APIサービス構築（他スレッドと共有するため実行時は専用HTTPクライアントを使う）
+        service = _get_service('analyticsdata', 'v1beta', GA4_SCOPES, credentials_file)
         
-        # 簡単なリクエスト
         request = {
-            'requests': [{
-                'property': f'properties/{property_id}',
-                'dateRanges': [{'startDate': '2025-10-01', 'endDate': '2025-10-01'}],
-                'metrics': [{'name': 'sessions'}],
-                'dimensions': [{'name': 'date'}],
-                'limit': 1
-            }]
+            'requests': [{'property': f'properties/{property_id}', **GA4_PROBE_REPORT}]
         }
         
         response = service.properties().batchRunReports(
             property=f'properties/{property_id}',
             body=request
-        ).execute()
+        ).execute(
+            http=thread_http(_get_credentials(credentials_file, GA4_SCOPES)),
+            num_retries=NUM_RETRIES
+        )
         
-        print(f"=== GA4 データアクセステスト (プロパティID: {property_id}) ===")
-        print("✅ アクセス成功")
+        lines.append("✅ アクセス成功")
         if 'reports' in response and response['reports']:
             report = response['reports'][0]
             if 'rows' in report:
-                print(f"データ行数: {len(report['rows'])}")
+                lines.append(f"データ行数: {len(report['rows'])}")
             else:
-                print("データ行なし")
+                lines.append("データ行なし")
         else:
-            print("レポートデータなし")
+            lines.append("レポートデータなし")
             
     except HttpError as e:
-        print(f"=== GA4 データアクセステスト (プロパティID: {property_id}) ===")
-        print(f"❌ アクセス失敗: {e}")
+        lines.append(f"❌ アクセス失敗: {e}")
     except Exception as e:
-        print(f"=== GA4 データアクセステスト (プロパティID: {property_id}) ===")
-        print(f"❌ エラー: {e}")
+        lines.append(f"❌ エラー: {e}")
+    
+    return lines
 
 def test_gsc_data_access(credentials_file, site_url):
-    """GSCデータアクセステスト"""
+    """
+    GSCデータアクセステスト
+    
+    Returns:
+        list: 表示する行
+    """
+    lines = [f"=== GSC データアクセステスト (サイトURL: {site_url}) ==="]
     try:
-        credentials = service_account.Credentials.from_service_account_file(
-            credentials_file,
-            scopes=['https://www.googleapis.com/auth/webmasters.readonly']
-        )
-        
-        # GSC APIサービス構築
-        service = build('searchconsole', 'v1', credentials=credentials)
-        
-        # 簡単なリクエスト
-        request = {
-            'startDate': '2025-10-01',
-            'endDate': '2025-10-01',
-            'dimensions': ['date'],
-            'rowLimit': 1
-        }
+        # GSC APIサービス構築（他スレッドと共有するため実行時は専用HTTPクライアントを使う）
+        service = _get_service('searchconsole', 'v1', GSC_SCOPES, credentials_file)
         
         response = service.searchanalytics().query(
             siteUrl=site_url,
-            body=request
-        ).execute()
+            body=GSC_PROBE_BODY
+        ).execute(
+            http=thread_http(_get_credentials(credentials_file, GSC_SCOPES)),
+            num_retries=NUM_RETRIES
+        )
         
-        print(f"=== GSC データアクセステスト (サイトURL: {site_url}) ===")
-        print("✅ アクセス成功")
+        lines.append("✅ アクセス成功")
         if 'rows' in response:
-            print(f"データ行数: {len(response['rows'])}")
+            lines.append(f"データ行数: {len(response['rows'])}")
         else:
-            print("データ行なし")
+            lines.append("データ行なし")
             
     except HttpError as e:
-        print(f"=== GSC データアクセステスト (サイトURL: {site_url}) ===")
-        print(f"❌ アクセス失敗: {e}")
+        lines.append(f"❌ アクセス失敗: {e}")
     except Exception as e:
-        print(f"=== GSC データアクセステスト (サイトURL: {site_url}) ===")
-        print(f"❌ エラー: {e}")
+        lines.append(f"❌ エラー: {e}")
+    
+    return lines
 
 def main():
     """メイン実行関数"""
     print("=== 権限確認スクリプト ===")
     
-    credentials_file = 'config/google-credentials.json'
+    credentials_file = CREDENTIALS_FILE
     
     if not os.path.exists(credentials_file):
         print(f"認証ファイルが見つかりません: {credentials_file}")
@@ -193,25 +276,43 @@ def main():
     print()
     
     # 設定ファイルのプロパティIDでテスト
-    config_file = 'config/analytics_config.json'
-    if os.path.exists(config_file):
-        with open(config_file, 'r', encoding='utf-8') as f:
+    try:
+        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
             config = json.load(f)
-        
-        sites = config.get('sites', {})
+    except FileNotFoundError:
+        return
+    
+    sites = config.get('sites', {})
+    
+    # 全サイトのGA4/GSCテストは互いに独立しているため並列に発行し、結果はサイト順に表示する。
+    # 複数サイトで同じプロパティID・サイトURLを使う場合は1回だけ問い合わせ、結果を共有する
+    ga4_futures = {}
+    gsc_futures = {}
+    with ThreadPoolExecutor(max_workers=max(1, 2 * len(sites))) as ex:
+        site_futures = []
         for site_name, site_config in sites.items():
-            print(f"=== {site_name.upper()} サイトのテスト ===")
+            futures = []
             
             # GA4テスト
             ga4_property_id = site_config.get('ga4_property_id')
             if ga4_property_id and ga4_property_id != 'your-ga4-property-id-for-idea':
-                test_ga4_data_access(credentials_file, ga4_property_id)
+                if ga4_property_id not in ga4_futures:
+                    ga4_futures[ga4_property_id] = ex.submit(test_ga4_data_access, credentials_file, ga4_property_id)
+                futures.append(ga4_futures[ga4_property_id])
             
             # GSCテスト
             gsc_site_url = site_config.get('gsc_site_url')
             if gsc_site_url:
-                test_gsc_data_access(credentials_file, gsc_site_url)
+                if gsc_site_url not in gsc_futures:
+                    gsc_futures[gsc_site_url] = ex.submit(test_gsc_data_access, credentials_file, gsc_site_url)
+                futures.append(gsc_futures[gsc_site_url])
             
+            site_futures.append((site_name, futures))
+        
+        for site_name, futures in site_futures:
+            print(f"=== {site_name.upper()} サイトのテスト ===")
+            for fut in futures:
+                print('\n'.join(fut.result()))
             print()
 
 if __name__ == "__main__":
@@ -7,39 +7,107 @@
 """
 
 import os
+import re
 import json
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from typing import Dict, List, Optional, Any
 import logging
 
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
 # 相対インポートまたは絶対インポートを試みる
 try:
     from .google_apis_integration import GoogleAPIsIntegration
+    from ._common import (
+        build_cube, cache_file_path, read_cache, rollup_cube, save_json, thread_http, write_cache
+    )
 except ImportError:
     from google_apis_integration import GoogleAPIsIntegration
+    from _common import (
+        build_cube, cache_file_path, read_cache, rollup_cube, save_json, thread_http, write_cache
+    )
 
-# ログ設定
+# ログ設定（ファイル出力はインポート時ではなく、logs/ を作成した後に _attach_log_file で追加する）
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LOG_FILE = 'logs/christmas_season_report.log'
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    format=LOG_FORMAT,
     handlers=[
-        logging.FileHandler('logs/christmas_season_report.log'),
         logging.StreamHandler()
     ]
 )
 logger = logging.getLogger(__name__)
 
+
+def _attach_log_file():
+    """ルートロガーに LOG_FILE へのFileHandlerを追加（追加済みなら何もしない）"""
+    root = logging.getLogger()
+    log_path = os.path.abspath(LOG_FILE)
+    if any(isinstance(handler, logging.FileHandler) and handler.baseFilename == log_path
+           for handler in root.handlers):
+        return
+    
+    handler = logging.FileHandler(LOG_FILE)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    root.addHandler(handler)
+
+# 日別・デバイス別・流入元別分析の集計方法（指標 -> 'sum' / 'mean'）
+GA4_AGG_SPEC = {
+    'sessions': 'sum',
+    'users': 'sum',
+    'pageviews': 'sum',
+    'bounceRate': 'mean',
+    'averageSessionDuration': 'mean',
+    'conversions': 'sum',
+    'totalRevenue': 'sum'
+}
+# 中間集計のキー（各分析はこのいずれか1つで再集計する）
+GA4_CUBE_DIMENSIONS = ['date', 'deviceCategory', 'sourceMedium']
+
+# 値の種類が少ないためcategory型で保持するディメンション
+CATEGORY_DIMENSIONS = ('country', 'device', 'deviceCategory', 'sourceMedium')
+
+# API取得結果のキャッシュ（終了日が過去の期間は確定データのため期限なし、それ以外は CACHE_TTL 秒）
+CACHE_DIR = 'data/christmas_2024/cache'
+CACHE_TTL = 3600
+
+# キーワード分析で使うGSCディメンション（detail=True の場合はページ・国・デバイスも取得する）
+GSC_KEYWORD_DIMENSIONS = ['date', 'query']
+GSC_DETAIL_DIMENSIONS = ['date', 'query', 'page', 'country', 'device']
+
+# GSC取得を分割する期間の日数と同時リクエスト数の上限
+GSC_SHARD_DAYS = 7
+GSC_MAX_WORKERS = 8
+
+# キーワード判定をカテゴリごとに並列に行うスレッド数の上限（Arrowの正規表現カーネルはGILを解放する）
+KEYWORD_FILTER_MAX_WORKERS = os.cpu_count() or 1
+
 class ChristmasSeasonReportGenerator:
-    def __init__(self, credentials_file=None):
+    def __init__(self, credentials_file=None, cache_ttl=CACHE_TTL):
         """
         クリスマスシーズンレポート生成クラスの初期化
         
         Args:
             credentials_file (str): サービスアカウントキーファイルのパス
+            cache_ttl (int): 終了日が今日以降の期間を取得した結果のキャッシュ秒数
         """
+        self.cache_ttl = cache_ttl
         self.api_integration = GoogleAPIsIntegration(credentials_file)
         self.christmas_keywords = self._define_christmas_keywords()
+        # カテゴリ別のキーワード和集合パターン（エスケープ済みの正規表現文字列）
+        # Arrowの正規表現カーネルはコンパイル済みの re.Pattern を受け付けないため文字列で持ち、
+        # 大文字小文字の区別は str.contains(case=False) で外す
+        self._keyword_patterns = {
+            category: '|'.join(map(re.escape, keywords))
+            for category, keywords in self.christmas_keywords.items()
+        }
         self.report_period = {
             'start_date': '2024-11-01',
             'end_date': '2024-12-31'
@@ -49,6 +117,7 @@ class ChristmasSeasonReportGenerator:
         os.makedirs('logs', exist_ok=True)
         os.makedirs('data/processed', exist_ok=True)
         os.makedirs('data/christmas_2024', exist_ok=True)
+        _attach_log_file()
     
     def _define_christmas_keywords(self) -> Dict[str, List[str]]:
         """クリスマス関連キーワードの定義"""
@@ -75,10 +144,16 @@ class ChristmasSeasonReportGenerator:
             ]
         }
     
-    def get_christmas_gsc_data(self) -> Dict[str, pd.DataFrame]:
+    def get_christmas_gsc_data(self, detail: bool = False) -> Dict[str, pd.DataFrame]:
         """
         クリスマス関連キーワードのGSCデータを取得
         
+        キーワード分析は日付とクエリしか使わないため、既定ではこの2つのディメンションだけを取得する
+        （ページ・国・デバイスを含めると行数がその組み合わせの数だけ増える）。
+        
+        Args:
+            detail (bool): Trueの場合はページ・国・デバイス別の行も取得する
+        
         Returns:
             Dict[str, pd.DataFrame]: カテゴリ別のGSCデータ
         """
@@ -86,11 +161,17 @@ class ChristmasSeasonReportGenerator:
         
         christmas_data = {}
         
+        # サービス未初期化（認証情報の設定漏れなど）の場合は取得・分類を行わずに終了
+        if not self.api_integration.gsc_service:
+            logger.error("GSCサービスが初期化されていません")
+            return christmas_data
+        
         try:
             # 全期間のGSCデータを取得
             gsc_data = self._get_custom_gsc_data(
                 start_date=self.report_period['start_date'],
-                end_date=self.report_period['end_date']
+                end_date=self.report_period['end_date'],
+                dimensions=GSC_DETAIL_DIMENSIONS if detail else GSC_KEYWORD_DIMENSIONS
             )
             
             if gsc_data.empty:
@@ -98,8 +179,7 @@ class ChristmasSeasonReportGenerator:
                 return christmas_data
             
             # カテゴリ別にフィルタリング
-            for category, keywords in self.christmas_keywords.items():
-                filtered_data = self._filter_data_by_keywords(gsc_data, keywords)
+            for category, filtered_data in self._filter_data_by_keywords(gsc_data).items():
                 if not filtered_data.empty:
                     christmas_data[category] = filtered_data
                     logger.info(f"{category}: {len(filtered_data)}件のデータを取得")
@@ -111,15 +191,21 @@ class ChristmasSeasonReportGenerator:
             return christmas_data
     
     def _get_custom_gsc_data(self, start_date: str, end_date: str, 
-                           dimensions: List[str] = None, row_limit: int = 25000) -> pd.DataFrame:
+                           dimensions: List[str] = None, row_limit: int = 25000,
+                           bypass_cache: bool = False) -> pd.DataFrame:
         """
         カスタム日付範囲でGSCデータを取得
         
+        1リクエストの上限（row_limit行）を超える分は startRow でページングして全件取得する。
+        ディメンションに日付を含む場合は期間を GSC_SHARD_DAYS 日ごとに分割し、並列に取得する
+        （日付で分割しても行が重複・再集計されないため）。
+        
         Args:
             start_date (str): 開始日 (YYYY-MM-DD)
             end_date (str): 終了日 (YYYY-MM-DD)
             dimensions (list): 取得するディメンション
-            row_limit (int): 取得行数上限
+            row_limit (int): 1リクエストあたりの取得行数（GSC APIの上限は25000）
+            bypass_cache (bool): Trueの場合はキャッシュを読まずにAPIから取得する
         
         Returns:
             pd.DataFrame: GSCデータ
@@ -129,73 +215,148 @@ class ChristmasSeasonReportGenerator:
             return pd.DataFrame()
         
         if not dimensions:
-            dimensions = ['date', 'query', 'page', 'country', 'device']
+            dimensions = GSC_DETAIL_DIMENSIONS
+        
+        cache_path = cache_file_path(
+            CACHE_DIR, 'gsc', site_url=self.api_integration.gsc_site_url, start_date=start_date,
+            end_date=end_date, dimensions=dimensions, row_limit=row_limit
+        )
+        if not bypass_cache:
+            cached = read_cache(cache_path, self._cache_ttl_for(end_date))
+            if cached is not None:
+                logger.info(f"GSCデータをキャッシュから読み込み: {len(cached)}行 ({start_date} - {end_date})")
+                return cached
         
         try:
-            # GSCリクエスト作成
+            if 'date' in dimensions:
+                shards = self._split_date_range(start_date, end_date, GSC_SHARD_DAYS)
+            else:
+                shards = [(start_date, end_date)]
+            if not shards:
+                logger.warning(f"GSCデータの取得期間が不正です: {start_date} - {end_date}")
+                return pd.DataFrame()
+            
+            # API呼び出し（期間ごとに並列、結果は期間順に連結）
+            with ThreadPoolExecutor(max_workers=min(GSC_MAX_WORKERS, len(shards))) as ex:
+                pages = ex.map(
+                    lambda shard: self._fetch_gsc_rows(shard[0], shard[1], dimensions, row_limit),
+                    shards
+                )
+                rows = [row for page in pages for row in page]
+            
+            # データの変換（行ごとの辞書を作らず、列ごとのリストから直接DataFrameを構築）
+            if rows:
+                columns = {
+                    metric: [row.get(metric, 0) for row in rows]
+                    for metric in ('clicks', 'impressions', 'ctr', 'position')
+                }
+                keys = [row.get('keys', []) for row in rows]
+                for i, dimension in enumerate(dimensions):
+                    columns[dimension] = [row_keys[i] if i < len(row_keys) else None for row_keys in keys]
+                df = pd.DataFrame(columns)
+            else:
+                df = pd.DataFrame()
+            
+            # pyarrowがあればディメンション列をArrow文字列型にし、キーワード判定をArrowの正規表現カーネルで行う
+            if pa is not None:
+                df = df.astype({dimension: 'string[pyarrow]' for dimension in dimensions if dimension in df.columns})
+            df = self._categorize_dimensions(df)
+            
+            if not df.empty:
+                write_cache(cache_path, df)
+            
+            logger.info(f"GSCデータ取得完了: {len(df)}行 ({start_date} - {end_date})")
+            return df
+            
+        except Exception as e:
+            logger.error(f"GSCデータ取得エラー: {e}")
+            return pd.DataFrame()
+    
+    @staticmethod
+    def _categorize_dimensions(df: pd.DataFrame) -> pd.DataFrame:
+        """CATEGORY_DIMENSIONS に含まれる列をcategory型に変換（集計は整数コードで行われる）"""
+        return df.astype({dimension: 'category' for dimension in CATEGORY_DIMENSIONS if dimension in df.columns})
+    
+    def _cache_ttl_for(self, end_date: str) -> Optional[int]:
+        """終了日が過去ならデータは確定しているため期限なし（None）、それ以外は cache_ttl 秒"""
+        return None if end_date < date.today().isoformat() else self.cache_ttl
+    
+    @staticmethod
+    def _split_date_range(start_date: str, end_date: str, days: int) -> List[tuple]:
+        """期間を days 日ごとの (開始日, 終了日) に分割"""
+        start = datetime.strptime(start_date, '%Y-%m-%d').date()
+        end = datetime.strptime(end_date, '%Y-%m-%d').date()
+        shards = []
+        while start <= end:
+            shard_end = min(start + timedelta(days=days - 1), end)
+            shards.append((start.isoformat(), shard_end.isoformat()))
+            start = shard_end + timedelta(days=1)
+        return shards
+    
+    def _fetch_gsc_rows(self, start_date: str, end_date: str,
+                        dimensions: List[str], row_limit: int) -> List[Dict[str, Any]]:
+        """1期間分のGSCデータを startRow でページングしながら全行取得"""
+        rows = []
+        while True:
             request = {
                 'startDate': start_date,
                 'endDate': end_date,
                 'dimensions': dimensions,
                 'rowLimit': row_limit,
-                'startRow': 0
+                'startRow': len(rows)
             }
-            
-            # API呼び出し
             response = self.api_integration.gsc_service.searchanalytics().query(
                 siteUrl=self.api_integration.gsc_site_url,
                 body=request
-            ).execute()
+            ).execute(http=thread_http(self.api_integration.credentials, timeout=60))
             
-            # データの変換
-            data = []
-            if 'rows' in response:
-                for row in response['rows']:
-                    row_data = {
-                        'clicks': row.get('clicks', 0),
-                        'impressions': row.get('impressions', 0),
-                        'ctr': row.get('ctr', 0),
-                        'position': row.get('position', 0)
-                    }
-                    
-                    # ディメンション値の追加
-                    for i, dimension in enumerate(dimensions):
-                        if i < len(row.get('keys', [])):
-                            row_data[dimension] = row['keys'][i]
-                    
-                    data.append(row_data)
-            
-            df = pd.DataFrame(data)
-            logger.info(f"GSCデータ取得完了: {len(df)}行 ({start_date} - {end_date})")
-            return df
-            
-        except Exception as e:
-            logger.error(f"GSCデータ取得エラー: {e}")
-            return pd.DataFrame()
+            page = response.get('rows', [])
+            rows.extend(page)
+            if len(page) < row_limit:
+                return rows
     
-    def _filter_data_by_keywords(self, data: pd.DataFrame, keywords: List[str]) -> pd.DataFrame:
+    def _filter_data_by_keywords(self, data: pd.DataFrame) -> Dict[str, pd.DataFrame]:
         """
-        キーワードリストでデータをフィルタリング
+        カテゴリ別のキーワードパターンでデータをフィルタリング
+        
+        同じクエリが日付・ページ・デバイスごとに繰り返し現れるため、クエリ列を一度だけ
+        factorizeし、各カテゴリのパターンはユニークなクエリに対してのみ評価する。
+        クエリ列がArrow文字列型であれば判定はArrow（RE2）の正規表現カーネルで行われ、
+        カーネル実行中はGILが解放されるため、カテゴリごとの判定をスレッドで並列に行う。
+        1つのクエリが複数カテゴリに該当する場合は、そのすべてに含める。
         
         Args:
             data (pd.DataFrame): フィルタリングするデータ
-            keywords (list): フィルタリングキーワード
         
         Returns:
-            pd.DataFrame: フィルタリングされたデータ
+            Dict[str, pd.DataFrame]: カテゴリ別のフィルタリングされたデータ
         """
         if data.empty or 'query' not in data.columns:
-            return pd.DataFrame()
-        
-        # キーワードパターンを作成
-        keyword_pattern = '|'.join(keywords)
-        
-        # クエリ列でフィルタリング
-        filtered_data = data[
-            data['query'].str.contains(keyword_pattern, case=False, na=False)
-        ].copy()
+            return {}
         
-        return filtered_data
+        codes, uniques = pd.factorize(data['query'])
+        uniques = pd.Series(uniques)
+        
+        def match(pattern):
+            return uniques.str.contains(pattern, case=False, na=False).to_numpy(dtype=bool)
+        
+        patterns = self._keyword_patterns
+        max_workers = min(KEYWORD_FILTER_MAX_WORKERS, len(patterns))
+        if pa is not None and uniques.dtype == 'string[pyarrow]' and max_workers > 1:
+            with ThreadPoolExecutor(max_workers=max_workers) as ex:
+                hits_by_category = dict(zip(patterns, ex.map(match, patterns.values())))
+        else:
+            # Pythonのreでの判定はGILを保持するため、スレッドに分けずに順に処理する
+            hits_by_category = {category: match(pattern) for category, pattern in patterns.items()}
+        
+        # ブールインデックスの結果はすでに新しいDataFrameのため、さらに.copy()はしない
+        # （後続の分析は読み取りのみ）
+        filtered = {}
+        for category, hits in hits_by_category.items():
+            # 末尾のFalseは欠損値（コード -1）用
+            filtered[category] = data[np.append(hits, False)[codes]]
+        
+        return filtered
     
     def get_christmas_ga4_data(self) -> Dict[str, Any]:
         """
@@ -206,6 +367,11 @@ class ChristmasSeasonReportGenerator:
         """
         logger.info("クリスマス期間のGA4データ取得開始")
         
+        # サービス未初期化（認証情報の設定漏れなど）の場合は取得・集計を行わずに終了
+        if not self.api_integration.ga4_service:
+            logger.error("GA4サービスが初期化されていません")
+            return {}
+        
         try:
             # カスタム日付範囲でGA4データを取得
             ga4_data = self._get_custom_ga4_data(
@@ -220,14 +386,17 @@ class ChristmasSeasonReportGenerator:
             # サマリー統計の計算
             summary = self._calculate_ga4_summary(ga4_data)
             
+            # 日別・デバイス別・流入元別の分析に共通の中間集計（元データの走査は1回）
+            cube = self._build_ga4_cube(ga4_data)
+            
             # 日別トレンドの計算
-            daily_trends = self._calculate_daily_trends(ga4_data)
+            daily_trends = self._calculate_daily_trends(cube)
             
             # デバイス別分析
-            device_analysis = self._analyze_by_device(ga4_data)
+            device_analysis = self._analyze_by_device(cube)
             
             # トラフィックソース分析
-            traffic_analysis = self._analyze_traffic_sources(ga4_data)
+            traffic_analysis = self._analyze_traffic_sources(cube)
             
             return {
                 'raw_data': ga4_data,
@@ -242,7 +411,8 @@ class ChristmasSeasonReportGenerator:
             return {}
     
     def _get_custom_ga4_data(self, start_date: str, end_date: str,
-                           metrics: List[str] = None, dimensions: List[str] = None) -> pd.DataFrame:
+                           metrics: List[str] = None, dimensions: List[str] = None,
+                           bypass_cache: bool = False) -> pd.DataFrame:
         """
         カスタム日付範囲でGA4データを取得
         
@@ -251,6 +421,7 @@ class ChristmasSeasonReportGenerator:
             end_date (str): 終了日 (YYYY-MM-DD)
             metrics (list): 取得するメトリクス
             dimensions (list): 取得するディメンション
+            bypass_cache (bool): Trueの場合はキャッシュを読まずにAPIから取得する
         
         Returns:
             pd.DataFrame: GA4データ
@@ -272,6 +443,16 @@ class ChristmasSeasonReportGenerator:
                 'date', 'pagePath', 'sourceMedium', 'deviceCategory', 'country'
             ]
         
+        cache_path = cache_file_path(
+            CACHE_DIR, 'ga4', property_id=self.api_integration.ga4_property_id, start_date=start_date,
+            end_date=end_date, metrics=metrics, dimensions=dimensions
+        )
+        if not bypass_cache:
+            cached = read_cache(cache_path, self._cache_ttl_for(end_date))
+            if cached is not None:
+                logger.info(f"GA4データをキャッシュから読み込み: {len(cached)}行 ({start_date} - {end_date})")
+                return cached
+        
         try:
             # GA4リクエスト作成
             request = {
@@ -290,31 +471,39 @@ class ChristmasSeasonReportGenerator:
                 body=request
             ).execute()
             
-            # データの変換
-            data = []
-            if 'reports' in response:
-                for report in response['reports']:
-                    if 'rows' in report:
-                        for row in report['rows']:
-                            row_data = {}
-                            
-                            # ディメンション値の取得
-                            for i, dimension in enumerate(dimensions):
-                                if i < len(row.get('dimensionValues', [])):
-                                    row_data[dimension] = row['dimensionValues'][i].get('value', '')
-                            
-                            # メトリクス値の取得
-                            for i, metric in enumerate(metrics):
-                                if i < len(row.get('metricValues', [])):
-                                    value = row['metricValues'][i].get('value', '0')
-                                    try:
-                                        row_data[metric] = float(value)
-                                    except ValueError:
-                                        row_data[metric] = value
-                            
-                            data.append(row_data)
-            
-            df = pd.DataFrame(data)
+            # データの変換（行ごとの辞書を作らず、列ごとのリストから直接DataFrameを構築）
+            rows = [row for report in response.get('reports', []) for row in report.get('rows', [])]
+            if rows:
+                columns = {}
+                
+                # ディメンション値の取得
+                dimension_values = [row.get('dimensionValues', []) for row in rows]
+                for i, dimension in enumerate(dimensions):
+                    columns[dimension] = [
+                        values[i].get('value', '') if i < len(values) else None
+                        for values in dimension_values
+                    ]
+                
+                # メトリクス値の取得（文字列のまま集め、数値への変換は列ごとにまとめて行う）
+                metric_values = [row.get('metricValues', []) for row in rows]
+                for i, metric in enumerate(metrics):
+                    columns[metric] = [
+                        values[i].get('value', '0') if i < len(values) else None
+                        for values in metric_values
+                    ]
+                
+                df = pd.DataFrame(columns)
+                
+                # 数値に変換できない値はNaNにする（従来どおりfloat型で保持）
+                for metric in metrics:
+                    df[metric] = pd.to_numeric(df[metric], errors='coerce').astype('float64')
+            else:
+                df = pd.DataFrame()
+            df = self._categorize_dimensions(df)
+            
+            if not df.empty:
+                write_cache(cache_path, df)
+            
             logger.info(f"GA4データ取得完了: {len(df)}行 ({start_date} - {end_date})")
             return df
             
@@ -347,59 +536,42 @@ class ChristmasSeasonReportGenerator:
         
         return summary
     
-    def _calculate_daily_trends(self, ga4_data: pd.DataFrame) -> pd.DataFrame:
+    def _build_ga4_cube(self, ga4_data: pd.DataFrame) -> pd.DataFrame:
+        """日付×デバイス×流入元の中間テーブルを作成（取得データにある列だけをキーにする）"""
+        keys = [dimension for dimension in GA4_CUBE_DIMENSIONS if dimension in ga4_data.columns]
+        if not keys:
+            return pd.DataFrame()
+        return build_cube(ga4_data, keys, GA4_AGG_SPEC)
+    
+    def _calculate_daily_trends(self, cube: pd.DataFrame) -> pd.DataFrame:
         """日別トレンドを計算"""
-        if ga4_data.empty or 'date' not in ga4_data.columns:
+        if cube.empty or 'date' not in cube.index.names:
             return pd.DataFrame()
         
         # 日別で集計
-        daily_data = ga4_data.groupby('date').agg({
-            'sessions': 'sum',
-            'users': 'sum',
-            'pageviews': 'sum',
-            'bounceRate': 'mean',
-            'averageSessionDuration': 'mean',
-            'conversions': 'sum',
-            'totalRevenue': 'sum'
-        }).reset_index()
+        daily_data = rollup_cube(cube, 'date', GA4_AGG_SPEC)
         
         # 日付をdatetimeに変換
         daily_data['date'] = pd.to_datetime(daily_data['date'])
         
         return daily_data.sort_values('date')
     
-    def _analyze_by_device(self, ga4_data: pd.DataFrame) -> pd.DataFrame:
+    def _analyze_by_device(self, cube: pd.DataFrame) -> pd.DataFrame:
         """デバイス別分析"""
-        if ga4_data.empty or 'deviceCategory' not in ga4_data.columns:
+        if cube.empty or 'deviceCategory' not in cube.index.names:
             return pd.DataFrame()
         
-        device_data = ga4_data.groupby('deviceCategory').agg({
-            'sessions': 'sum',
-            'users': 'sum',
-            'pageviews': 'sum',
-            'bounceRate': 'mean',
-            'averageSessionDuration': 'mean',
-            'conversions': 'sum',
-            'totalRevenue': 'sum'
-        }).reset_index()
+        device_data = rollup_cube(cube, 'deviceCategory', GA4_AGG_SPEC)
         
         # セッション数でソート
         return device_data.sort_values('sessions', ascending=False)
     
-    def _analyze_traffic_sources(self, ga4_data: pd.DataFrame) -> pd.DataFrame:
+    def _analyze_traffic_sources(self, cube: pd.DataFrame) -> pd.DataFrame:
         """トラフィックソース分析"""
-        if ga4_data.empty or 'sourceMedium' not in ga4_data.columns:
+        if cube.empty or 'sourceMedium' not in cube.index.names:
             return pd.DataFrame()
         
-        traffic_data = ga4_data.groupby('sourceMedium').agg({
-            'sessions': 'sum',
-            'users': 'sum',
-            'pageviews': 'sum',
-            'bounceRate': 'mean',
-            'averageSessionDuration': 'mean',
-            'conversions': 'sum',
-            'totalRevenue': 'sum'
-        }).reset_index()
+        traffic_data = rollup_cube(cube, 'sourceMedium', GA4_AGG_SPEC)
         
         # セッション数でソート
         return traffic_data.sort_values('sessions', ascending=False)
@@ -462,29 +634,30 @@ class ChristmasSeasonReportGenerator:
                     continue
                 
                 # 高インプレッション・低CTRキーワード
-                high_imp_low_ctr = data[
-                    (data['impressions'] > data['impressions'].quantile(0.75)) &
-                    (data['ctr'] < data['ctr'].quantile(0.25))
-                ]
+                # 分位点は1回でまとめて求め、条件はnumpy配列で判定して先頭5行だけを取り出す
+                quantiles = data[['impressions', 'ctr']].quantile([0.25, 0.75])
+                high_imp_low_ctr = np.flatnonzero(
+                    (data['impressions'].to_numpy() > quantiles.loc[0.75, 'impressions']) &
+                    (data['ctr'].to_numpy() < quantiles.loc[0.25, 'ctr'])
+                )
                 
-                if not high_imp_low_ctr.empty:
+                if len(high_imp_low_ctr):
                     opportunities.append({
                         'type': 'CTR改善機会',
                         'category': category,
-                        'keywords': high_imp_low_ctr.head(5)[['query', 'impressions', 'ctr', 'position']].to_dict('records'),
+                        'keywords': data.iloc[high_imp_low_ctr[:5]][['query', 'impressions', 'ctr', 'position']].to_dict('records'),
                         'description': f'{category}カテゴリでCTR改善の機会があります'
                     })
                 
                 # 10-20位のキーワード
-                ranking_opportunities = data[
-                    (data['position'] >= 10) & (data['position'] <= 20)
-                ]
+                position = data['position'].to_numpy()
+                ranking_opportunities = np.flatnonzero((position >= 10) & (position <= 20))
                 
-                if not ranking_opportunities.empty:
+                if len(ranking_opportunities):
                     opportunities.append({
                         'type': '順位上昇機会',
                         'category': category,
-                        'keywords': ranking_opportunities.head(5)[['query', 'clicks', 'position']].to_dict('records'),
+                        'keywords': data.iloc[ranking_opportunities[:5]][['query', 'clicks', 'position']].to_dict('records'),
                         'description': f'{category}カテゴリで順位上昇の機会があります'
                     })
             
@@ -504,6 +677,9 @@ class ChristmasSeasonReportGenerator:
         logger.info("包括的クリスマスシーズンレポート生成開始")
         
         try:
+            # 生成日時（JSON・Markdownのファイル名と generated_at で同じ時刻を使う）
+            generated_at = datetime.now()
+            
             # データ取得
             gsc_data = self.get_christmas_gsc_data()
             ga4_data = self.get_christmas_ga4_data()
@@ -516,7 +692,7 @@ class ChristmasSeasonReportGenerator:
                 'report_metadata': {
                     'title': '2024年クリスマスシーズンレポート',
                     'period': f"{self.report_period['start_date']} - {self.report_period['end_date']}",
-                    'generated_at': datetime.now().isoformat(),
+                    'generated_at': generated_at.isoformat(),
                     'site_url': self.api_integration.gsc_site_url
                 },
                 'gsc_data': gsc_data,
@@ -526,7 +702,7 @@ class ChristmasSeasonReportGenerator:
             }
             
             # レポート保存
-            self._save_report(comprehensive_report)
+            self._save_report(comprehensive_report, generated_at.strftime("%Y%m%d_%H%M%S"))
             
             logger.info("包括的クリスマスシーズンレポート生成完了")
             return comprehensive_report
@@ -575,28 +751,63 @@ class ChristmasSeasonReportGenerator:
             logger.error(f"推奨事項生成エラー: {e}")
             return recommendations
     
-    def _save_report(self, report: Dict[str, Any]):
-        """レポートの保存"""
+    def _save_report(self, report: Dict[str, Any], run_id: Optional[str] = None):
+        """
+        レポートの保存
+        
+        Args:
+            report (Dict[str, Any]): 包括的レポート
+            run_id (str): ファイル名に付ける生成日時（YYYYmmdd_HHMMSS、省略時は現在時刻）
+        """
+        if run_id is None:
+            run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+        
         try:
-            # JSON形式で保存
-            report_file = f'data/christmas_2024/christmas_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
-            with open(report_file, 'w', encoding='utf-8') as f:
-                json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+            # JSON形式で保存（DataFrameは別ファイルに保存し、JSONにはそのパスを記録）
+            report_name = f'christmas_report_{run_id}'
+            report_file = f'data/christmas_2024/{report_name}.json'
+            saved_report = self._externalize_frames(report, f'data/christmas_2024/{report_name}')
+            save_json(saved_report, report_file)
             
             # サマリーレポートも生成
-            self._generate_summary_markdown(report)
+            self._generate_summary_markdown(report, run_id)
             
             logger.info(f"レポート保存完了: {report_file}")
             
         except Exception as e:
             logger.error(f"レポート保存エラー: {e}")
     
-    def _generate_summary_markdown(self, report: Dict[str, Any]):
-        """サマリーレポートのMarkdown生成"""
+    def _externalize_frames(self, report: Dict[str, Any], frame_dir: str) -> Dict[str, Any]:
+        """
+        gsc_data / ga4_data 内のDataFrameを frame_dir に1つずつ保存し、
+        DataFrameをJSONファイルからの相対パスに置き換えたレポートのコピーを返す（元のレポートは変更しない）
+        
+        pyarrowがあればzstd圧縮のParquet、なければBOM付きUTF-8のCSVで保存する。
+        """
+        saved_report = dict(report)
+        for section in ('gsc_data', 'ga4_data'):
+            values = dict(report.get(section) or {})
+            for key, value in values.items():
+                if not isinstance(value, pd.DataFrame):
+                    continue
+                
+                os.makedirs(frame_dir, exist_ok=True)
+                if pa is not None:
+                    file_name = f'{section}_{key}.parquet'
+                    value.to_parquet(os.path.join(frame_dir, file_name), index=False, compression='zstd')
+                else:
+                    file_name = f'{section}_{key}.csv'
+                    value.to_csv(os.path.join(frame_dir, file_name), index=False, encoding='utf-8-sig')
+                values[key] = f'{os.path.basename(frame_dir)}/{file_name}'
+            saved_report[section] = values
+        return saved_report
+    
+    def _generate_summary_markdown(self, report: Dict[str, Any], run_id: str):
+        """サマリーレポートのMarkdown生成（ファイル名の日時はJSONレポートと同じ run_id）"""
         try:
             markdown_content = self._format_report_as_markdown(report)
             
-            markdown_file = f'data/christmas_2024/christmas_summary_{datetime.now().strftime("%Y%m%d_%H%M%S")}.md'
+            markdown_file = f'data/christmas_2024/christmas_summary_{run_id}.md'
             with open(markdown_file, 'w', encoding='utf-8') as f:
                 f.write(markdown_content)
             
@@ -612,7 +823,8 @@ class ChristmasSeasonReportGenerator:
         keyword_analysis = report.get('keyword_analysis', {})
         recommendations = report.get('recommendations', [])
         
-        content = f"""# {metadata.get('title', 'クリスマスシーズンレポート')}
+        # 断片をリストに集めて最後に1回だけ連結する
+        parts = [f"""# {metadata.get('title', 'クリスマスシーズンレポート')}
 
 **期間**: {metadata.get('period', 'N/A')}  
 **生成日時**: {metadata.get('generated_at', 'N/A')}  
@@ -621,12 +833,12 @@ class ChristmasSeasonReportGenerator:
 ## 📊 概要
 
 ### GA4パフォーマンス
-"""
+"""]
         
         # GA4サマリー
         if 'summary' in ga4_data:
             summary = ga4_data['summary']
-            content += f"""
+            parts.append(f"""
 - **総セッション数**: {summary.get('total_sessions', 0):,}
 - **総ユーザー数**: {summary.get('total_users', 0):,}
 - **総ページビュー**: {summary.get('total_pageviews', 0):,}
@@ -634,29 +846,29 @@ class ChristmasSeasonReportGenerator:
 - **平均セッション時間**: {summary.get('avg_session_duration', 0):.1f}秒
 - **総コンバージョン数**: {summary.get('total_conversions', 0):,}
 - **総収益**: ¥{summary.get('total_revenue', 0):,.0f}
-"""
+""")
         
         # キーワード分析
-        content += "\n## 🔍 クリスマス関連キーワード分析\n"
+        parts.append("\n## 🔍 クリスマス関連キーワード分析\n")
         
         for category, summary in keyword_analysis.get('category_summary', {}).items():
-            content += f"""
+            parts.append(f"""
 ### {category.replace('_', ' ').title()}
 - **総クリック数**: {summary.get('total_clicks', 0):,}
 - **総インプレッション数**: {summary.get('total_impressions', 0):,}
 - **平均CTR**: {summary.get('avg_ctr', 0):.2f}%
 - **平均順位**: {summary.get('avg_position', 0):.1f}位
 - **キーワード数**: {summary.get('keyword_count', 0)}個
-"""
+""")
         
         # 推奨事項
         if recommendations:
-            content += "\n## 💡 推奨事項\n"
+            parts.append("\n## 💡 推奨事項\n")
             for i, rec in enumerate(recommendations, 1):
                 priority_emoji = "🔴" if rec.get('priority') == 'high' else "🟡"
-                content += f"{i}. {priority_emoji} **{rec.get('type', 'N/A')}**: {rec.get('message', 'N/A')}\n"
+                parts.append(f"{i}. {priority_emoji} **{rec.get('type', 'N/A')}**: {rec.get('message', 'N/A')}\n")
         
-        content += f"""
+        parts.append(f"""
 ## 📈 今後のアクション
 
 1. **高優先度のSEO改善**を実施
@@ -665,10 +877,10 @@ class ChristmasSeasonReportGenerator:
 4. **定期監視**による継続的な改善
 
 ---
-*このレポートは自動生成されました。詳細な分析データはJSONファイルをご確認ください。*
-"""
+*このレポートは自動生成されました。詳細な分析データはJSONファイルと、そこから参照されるデータファイルをご確認ください。*
+""")
         
-        return content
+        return "".join(parts)
 
 def main():
     """メイン実行関数"""
@@ -9,6 +9,7 @@
 
 import os
 import json
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any, Tuple
@@ -17,8 +18,10 @@ import logging
 # 相対インポートまたは絶対インポートを試みる
 try:
     from .oauth_google_apis import OAuthGoogleAPIsIntegration
+    from ._common import build_cube, downcast_counts, rollup_cube, save_json, startswith_mask
 except ImportError:
     from oauth_google_apis import OAuthGoogleAPIsIntegration
+    from _common import build_cube, downcast_counts, rollup_cube, save_json, startswith_mask
 
 # ログ設定
 logging.basicConfig(
@@ -31,6 +34,35 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# ページ別・チャネル別分析の集計方法（指標 -> 'sum' / 'mean'）
+SITE_AGG_SPEC = {
+    'sessions': 'sum',
+    'totalUsers': 'sum',
+    'screenPageViews': 'sum',
+    'bounceRate': 'mean',
+    'averageSessionDuration': 'mean',
+    'conversions': 'sum',
+    'newUsers': 'sum',
+    'engagedSessions': 'sum'
+}
+# 中間集計のキー（ページ別・チャネル別の分析はこのいずれか1つで再集計する）
+SITE_CUBE_DIMENSIONS = ['pagePath', 'sessionDefaultChannelGrouping']
+
+# パスパターン分析のカテゴリ（パスに複数含まれる場合は先に書いたものを優先）
+PATH_CATEGORIES = ['beauty', 'wedding', 'birthday', 'christmas', 'mombaby', 'temiyage', 'foods-drink']
+
+# 改善機会の4象限（コード = 高トラフィック * 2 + 高CVR）
+OPPORTUNITY_QUADRANTS = {
+    'high_priority': 2,  # 高トラフィック・低CVR
+    'reinforce': 3,      # 高トラフィック・高CVR
+    'maintain': 1,       # 低トラフィック・高CVR
+    'low_priority': 0    # 低トラフィック・低CVR
+}
+
+# 取得直後にcategory型へ変換するディメンション（同じ値が多くの行で繰り返し現れる）
+CATEGORY_DIMENSIONS = ('pagePath', 'sessionDefaultChannelGrouping', 'deviceCategory', 'country')
+
+
 class ContentPerformanceAnalyzer:
     def __init__(self):
         """コンテンツパフォーマンス分析ツールの初期化"""
@@ -90,23 +122,30 @@ class ContentPerformanceAnalyzer:
                 body=request
             ).execute()
             
-            # データの変換
-            data = []
-            if 'rows' in response:
-                for row in response['rows']:
-                    row_data = {}
-                    
-                    # ディメンション
-                    for i, dimension in enumerate(request['dimensions']):
-                        row_data[dimension['name']] = row['dimensionValues'][i]['value']
-                    
-                    # メトリクス
-                    for i, metric in enumerate(request['metrics']):
-                        row_data[metric['name']] = float(row['metricValues'][i]['value'])
-                    
-                    data.append(row_data)
-            
-            df = pd.DataFrame(data)
+            # データの変換（行ごとの辞書を作らず、列ごとのリストから直接DataFrameを構築）
+            rows = response.get('rows', [])
+            if rows:
+                columns = {}
+                
+                # ディメンション
+                for i, dimension in enumerate(request['dimensions']):
+                    columns[dimension['name']] = [row['dimensionValues'][i]['value'] for row in rows]
+                
+                # メトリクス（文字列のリストからまとめてfloat64配列に変換）
+                for i, metric in enumerate(request['metrics']):
+                    columns[metric['name']] = np.array(
+                        [row['metricValues'][i]['value'] for row in rows], dtype=np.float64
+                    )
+                
+                df = pd.DataFrame(columns)
+                
+                # 合計する指標（件数系）だけ int32 に落とす（比率系は値が整数でも float64 のまま）
+                df = downcast_counts(df, [metric for metric, how in SITE_AGG_SPEC.items() if how == 'sum'])
+                
+                # 文字列のディメンションはcategory型にし、集計・絞り込みを整数コードで行う
+                df = df.astype({dimension: 'category' for dimension in CATEGORY_DIMENSIONS if dimension in df.columns})
+            else:
+                df = pd.DataFrame()
             logger.info(f"GA4データ取得完了: {len(df)}行")
             return df
             
@@ -121,10 +160,10 @@ class ContentPerformanceAnalyzer:
                 return {'moodmark': pd.DataFrame(), 'moodmarkgift': pd.DataFrame()}
             
             # moodmarkデータ（/moodmark/で始まるパス）
-            moodmark_data = ga4_data[ga4_data['pagePath'].str.startswith('/moodmark/', na=False)].copy()
+            moodmark_data = ga4_data[startswith_mask(ga4_data['pagePath'], '/moodmark/')].copy()
             
             # moodmarkgiftデータ（/moodmarkgift/で始まるパス）
-            moodmarkgift_data = ga4_data[ga4_data['pagePath'].str.startswith('/moodmarkgift/', na=False)].copy()
+            moodmarkgift_data = ga4_data[startswith_mask(ga4_data['pagePath'], '/moodmarkgift/')].copy()
             
             logger.info(f"moodmarkデータ: {len(moodmark_data)}行")
             logger.info(f"moodmarkgiftデータ: {len(moodmarkgift_data)}行")
@@ -138,23 +177,24 @@ class ContentPerformanceAnalyzer:
             logger.error(f"データ分割エラー: {e}")
             return {'moodmark': pd.DataFrame(), 'moodmarkgift': pd.DataFrame()}
     
-    def calculate_page_conversion_rates(self, site_data: pd.DataFrame, site_name: str) -> pd.DataFrame:
-        """ページ別のコンバージョン率算出"""
+    def calculate_page_conversion_rates(self, site_data: pd.DataFrame, site_name: str,
+                                        cube: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        """
+        ページ別のコンバージョン率算出
+        
+        Args:
+            site_data (pd.DataFrame): サイトのGA4データ
+            site_name (str): サイト名
+            cube (pd.DataFrame): build_cube の中間テーブル（省略時は site_data から作成）
+        """
         try:
             if site_data.empty:
                 return pd.DataFrame()
             
             # ページ別で集計
-            page_stats = site_data.groupby('pagePath').agg({
-                'sessions': 'sum',
-                'totalUsers': 'sum',
-                'screenPageViews': 'sum',
-                'bounceRate': 'mean',
-                'averageSessionDuration': 'mean',
-                'conversions': 'sum',
-                'newUsers': 'sum',
-                'engagedSessions': 'sum'
-            }).reset_index()
+            if cube is None:
+                cube = build_cube(site_data, SITE_CUBE_DIMENSIONS, SITE_AGG_SPEC)
+            page_stats = rollup_cube(cube, 'pagePath', SITE_AGG_SPEC)
             
             # コンバージョン率を計算
             page_stats['conversion_rate'] = (page_stats['conversions'] / page_stats['sessions'] * 100).fillna(0)
@@ -174,23 +214,24 @@ class ContentPerformanceAnalyzer:
             logger.error(f"{site_name}: ページ別CVR分析エラー: {e}")
             return pd.DataFrame()
     
-    def analyze_channel_performance(self, site_data: pd.DataFrame, site_name: str) -> Dict:
-        """流入チャネル別のパフォーマンス比較"""
+    def analyze_channel_performance(self, site_data: pd.DataFrame, site_name: str,
+                                    cube: Optional[pd.DataFrame] = None) -> Dict:
+        """
+        流入チャネル別のパフォーマンス比較
+        
+        Args:
+            site_data (pd.DataFrame): サイトのGA4データ
+            site_name (str): サイト名
+            cube (pd.DataFrame): build_cube の中間テーブル（省略時は site_data から作成）
+        """
         try:
             if site_data.empty:
                 return {}
             
             # チャネル別で集計
-            channel_stats = site_data.groupby('sessionDefaultChannelGrouping').agg({
-                'sessions': 'sum',
-                'totalUsers': 'sum',
-                'screenPageViews': 'sum',
-                'bounceRate': 'mean',
-                'averageSessionDuration': 'mean',
-                'conversions': 'sum',
-                'newUsers': 'sum',
-                'engagedSessions': 'sum'
-            }).reset_index()
+            if cube is None:
+                cube = build_cube(site_data, SITE_CUBE_DIMENSIONS, SITE_AGG_SPEC)
+            channel_stats = rollup_cube(cube, 'sessionDefaultChannelGrouping', SITE_AGG_SPEC)
             
             # メトリクス計算
             channel_stats['conversion_rate'] = (channel_stats['conversions'] / channel_stats['sessions'] * 100).fillna(0)
@@ -201,22 +242,20 @@ class ContentPerformanceAnalyzer:
             # セッション数でソート
             channel_stats = channel_stats.sort_values('sessions', ascending=False)
             
-            # 結果を辞書形式に変換
-            result = []
-            for _, row in channel_stats.iterrows():
-                result.append({
-                    'channel': row['sessionDefaultChannelGrouping'],
-                    'sessions': int(row['sessions']),
-                    'users': int(row['totalUsers']),
-                    'pageviews': int(row['screenPageViews']),
-                    'bounce_rate': round(row['bounceRate'] * 100, 2),
-                    'avg_session_duration': round(row['averageSessionDuration'], 1),
-                    'conversions': int(row['conversions']),
-                    'conversion_rate': round(row['conversion_rate'], 2),
-                    'engagement_rate': round(row['engagement_rate'], 2),
-                    'new_user_rate': round(row['new_user_rate'], 2),
-                    'pages_per_session': round(row['pages_per_session'], 2)
-                })
+            # 結果を辞書形式に変換（整数化・丸めは列ごとにまとめて行う）
+            result = pd.DataFrame({
+                'channel': channel_stats['sessionDefaultChannelGrouping'],
+                'sessions': channel_stats['sessions'].astype(np.int64),
+                'users': channel_stats['totalUsers'].astype(np.int64),
+                'pageviews': channel_stats['screenPageViews'].astype(np.int64),
+                'bounce_rate': (channel_stats['bounceRate'] * 100).round(2),
+                'avg_session_duration': channel_stats['averageSessionDuration'].round(1),
+                'conversions': channel_stats['conversions'].astype(np.int64),
+                'conversion_rate': channel_stats['conversion_rate'].round(2),
+                'engagement_rate': channel_stats['engagement_rate'].round(2),
+                'new_user_rate': channel_stats['new_user_rate'].round(2),
+                'pages_per_session': channel_stats['pages_per_session'].round(2)
+            }).to_dict('records')
             
             logger.info(f"{site_name}: チャネル別パフォーマンス分析完了 - {len(result)}チャネル")
             return {'channels': result}
@@ -225,15 +264,25 @@ class ContentPerformanceAnalyzer:
             logger.error(f"{site_name}: チャネル別パフォーマンス分析エラー: {e}")
             return {}
     
-    def identify_high_performance_patterns(self, page_stats: pd.DataFrame, site_name: str) -> Dict:
-        """高パフォーマンスページの共通パターン抽出"""
+    def identify_high_performance_patterns(self, page_stats: pd.DataFrame, site_name: str,
+                                           cvr_quantile_80: Optional[float] = None) -> Dict:
+        """
+        高パフォーマンスページの共通パターン抽出
+        
+        Args:
+            page_stats (pd.DataFrame): ページ別CVR分析の結果
+            site_name (str): サイト名
+            cvr_quantile_80 (float): CVRの80パーセンタイル（求め済みの場合、省略時は page_stats から算出）
+        """
         try:
             if page_stats.empty:
                 return {}
             
             # 高CVRページの定義（上位20%またはCVR 5%以上）
-            high_cvr_threshold = max(page_stats['conversion_rate'].quantile(0.8), 5.0)
-            high_cvr_pages = page_stats[page_stats['conversion_rate'] >= high_cvr_threshold].copy()
+            if cvr_quantile_80 is None:
+                cvr_quantile_80 = page_stats['conversion_rate'].quantile(0.8)
+            high_cvr_threshold = max(cvr_quantile_80, 5.0)
+            high_cvr_pages = page_stats[page_stats['conversion_rate'].to_numpy() >= high_cvr_threshold]
             
             if high_cvr_pages.empty:
                 logger.warning(f"{site_name}: 高CVRページが見つかりません")
@@ -259,48 +308,24 @@ class ContentPerformanceAnalyzer:
     
     def _analyze_path_patterns(self, high_cvr_pages: pd.DataFrame) -> List[Dict]:
         """パスパターンの分析"""
-        patterns = []
+        # カテゴリの抽出（PATH_CATEGORIES の順に判定し、どれにも該当しなければ other）
+        paths = high_cvr_pages['pagePath']
+        categories = np.select(
+            [paths.str.contains(f'/{category}/', regex=False, na=False).to_numpy(dtype=bool)
+             for category in PATH_CATEGORIES],
+            PATH_CATEGORIES,
+            default='other'
+        )
         
-        # カテゴリ別の分析
-        categories = {}
-        for _, row in high_cvr_pages.iterrows():
-            path = row['pagePath']
-            cvr = row['conversion_rate']
-            
-            # カテゴリの抽出
-            if '/beauty/' in path:
-                category = 'beauty'
-            elif '/wedding/' in path:
-                category = 'wedding'
-            elif '/birthday/' in path:
-                category = 'birthday'
-            elif '/christmas/' in path:
-                category = 'christmas'
-            elif '/mombaby/' in path:
-                category = 'mombaby'
-            elif '/temiyage/' in path:
-                category = 'temiyage'
-            elif '/foods-drink/' in path:
-                category = 'foods-drink'
-            else:
-                category = 'other'
-            
-            if category not in categories:
-                categories[category] = []
-            categories[category].append(cvr)
-        
-        # カテゴリ別の平均CVRを計算
-        for category, cvrs in categories.items():
-            if len(cvrs) >= 2:  # 2ページ以上あるカテゴリのみ
-                patterns.append({
-                    'category': category,
-                    'page_count': len(cvrs),
-                    'avg_cvr': round(sum(cvrs) / len(cvrs), 2),
-                    'max_cvr': round(max(cvrs), 2),
-                    'pattern_type': 'category_performance'
-                })
+        # カテゴリ別の平均CVRを計算（出現順に集計）
+        stats = high_cvr_pages['conversion_rate'].groupby(categories, sort=False).agg(
+            page_count='size', avg_cvr='mean', max_cvr='max'
+        )
+        stats = stats[stats['page_count'] >= 2].round({'avg_cvr': 2, 'max_cvr': 2})  # 2ページ以上あるカテゴリのみ
+        stats = stats.rename_axis('category').reset_index()
+        stats['pattern_type'] = 'category_performance'
         
-        return sorted(patterns, key=lambda x: x['avg_cvr'], reverse=True)
+        return stats.sort_values('avg_cvr', ascending=False, kind='stable').to_dict('records')
     
     def _generate_performance_insights(self, high_cvr_pages: pd.DataFrame) -> List[str]:
         """パフォーマンスインサイトの生成"""
@@ -335,49 +360,40 @@ class ContentPerformanceAnalyzer:
         
         return insights
     
-    def identify_improvement_opportunities(self, page_stats: pd.DataFrame, site_name: str) -> Dict:
-        """改善が必要なページの特定（4象限分析）"""
+    def identify_improvement_opportunities(self, page_stats: pd.DataFrame, site_name: str,
+                                           high_traffic_threshold: Optional[float] = None,
+                                           high_cvr_threshold: Optional[float] = None) -> Dict:
+        """
+        改善が必要なページの特定（4象限分析）
+        
+        Args:
+            page_stats (pd.DataFrame): ページ別CVR分析の結果
+            site_name (str): サイト名
+            high_traffic_threshold (float): セッション数の70パーセンタイル（省略時は page_stats から算出）
+            high_cvr_threshold (float): CVRの70パーセンタイル（省略時は page_stats から算出）
+        """
         try:
             if page_stats.empty:
                 return {}
             
             # 閾値の設定
-            high_traffic_threshold = page_stats['sessions'].quantile(0.7)  # 上位30%
-            high_cvr_threshold = page_stats['conversion_rate'].quantile(0.7)  # 上位30%
-            
-            # 4象限に分類
-            opportunities = {
-                'high_priority': [],  # 高トラフィック・低CVR
-                'reinforce': [],      # 高トラフィック・高CVR
-                'maintain': [],       # 低トラフィック・高CVR
-                'low_priority': []    # 低トラフィック・低CVR
-            }
-            
-            for _, row in page_stats.iterrows():
-                page_info = {
-                    'page_path': row['pagePath'],
-                    'sessions': int(row['sessions']),
-                    'conversion_rate': round(row['conversion_rate'], 2),
-                    'conversions': int(row['conversions']),
-                    'bounce_rate': round(row['bounceRate'] * 100, 2),
-                    'avg_session_duration': round(row['averageSessionDuration'], 1)
-                }
-                
-                is_high_traffic = row['sessions'] >= high_traffic_threshold
-                is_high_cvr = row['conversion_rate'] >= high_cvr_threshold
-                
-                if is_high_traffic and not is_high_cvr:
-                    opportunities['high_priority'].append(page_info)
-                elif is_high_traffic and is_high_cvr:
-                    opportunities['reinforce'].append(page_info)
-                elif not is_high_traffic and is_high_cvr:
-                    opportunities['maintain'].append(page_info)
-                else:
-                    opportunities['low_priority'].append(page_info)
-            
-            # 各カテゴリをセッション数でソート
-            for category in opportunities:
-                opportunities[category].sort(key=lambda x: x['sessions'], reverse=True)
+            if high_traffic_threshold is None:
+                high_traffic_threshold = page_stats['sessions'].quantile(0.7)  # 上位30%
+            if high_cvr_threshold is None:
+                high_cvr_threshold = page_stats['conversion_rate'].quantile(0.7)  # 上位30%
+            
+            # 4象限に分類（判定は列全体に対してまとめて行い、象限コードにする）
+            is_high_traffic = page_stats['sessions'].to_numpy() >= high_traffic_threshold
+            is_high_cvr = page_stats['conversion_rate'].to_numpy() >= high_cvr_threshold
+            quadrant = is_high_traffic.astype(np.int8) * 2 + is_high_cvr.astype(np.int8)
+            
+            # 各象限をセッション数でソート（同数の場合は元の順序を保つ）
+            opportunities = {}
+            for category, code in OPPORTUNITY_QUADRANTS.items():
+                pages = page_stats.iloc[np.flatnonzero(quadrant == code)]
+                opportunities[category] = self._page_records(
+                    pages.sort_values('sessions', ascending=False, kind='stable')
+                )
             
             # 改善提案の生成
             opportunities['improvement_suggestions'] = self._generate_improvement_suggestions(opportunities)
@@ -394,6 +410,17 @@ class ContentPerformanceAnalyzer:
             logger.error(f"{site_name}: 改善機会分析エラー: {e}")
             return {}
     
+    def _page_records(self, pages: pd.DataFrame) -> List[Dict]:
+        """改善機会分析のページ情報を辞書のリストに変換（整数化・丸めは列ごとにまとめて行う）"""
+        return pd.DataFrame({
+            'page_path': pages['pagePath'],
+            'sessions': pages['sessions'].astype(np.int64),
+            'conversion_rate': pages['conversion_rate'].round(2),
+            'conversions': pages['conversions'].astype(np.int64),
+            'bounce_rate': (pages['bounceRate'] * 100).round(2),
+            'avg_session_duration': pages['averageSessionDuration'].round(1)
+        }).to_dict('records')
+    
     def _generate_improvement_suggestions(self, opportunities: Dict) -> List[Dict]:
         """改善提案の生成"""
         suggestions = []
@@ -462,17 +489,34 @@ class ContentPerformanceAnalyzer:
                 
                 logger.info(f"{site_name}のコンテンツパフォーマンス分析開始")
                 
+                # ページ別・チャネル別の分析に共通の中間集計（元データの走査は1回）
+                cube = build_cube(site_data, SITE_CUBE_DIMENSIONS, SITE_AGG_SPEC)
+                totals = cube[['sessions', 'conversions']].sum()
+                
                 # ページ別CVR分析
-                page_stats = self.calculate_page_conversion_rates(site_data, site_name)
+                page_stats = self.calculate_page_conversion_rates(site_data, site_name, cube=cube)
                 
                 # チャネル別パフォーマンス分析
-                channel_performance = self.analyze_channel_performance(site_data, site_name)
+                channel_performance = self.analyze_channel_performance(site_data, site_name, cube=cube)
+                
+                # 高パフォーマンス・改善機会の閾値（CVRの分位点は1回の呼び出しでまとめて求める）
+                if not page_stats.empty:
+                    cvr_quantile_70, cvr_quantile_80 = page_stats['conversion_rate'].quantile([0.7, 0.8]).to_numpy()
+                    sessions_quantile_70 = page_stats['sessions'].quantile(0.7)
+                else:
+                    cvr_quantile_70 = cvr_quantile_80 = sessions_quantile_70 = None
                 
                 # 高パフォーマンスパターン分析
-                high_performance_patterns = self.identify_high_performance_patterns(page_stats, site_name)
+                high_performance_patterns = self.identify_high_performance_patterns(
+                    page_stats, site_name, cvr_quantile_80=cvr_quantile_80
+                )
                 
                 # 改善機会分析
-                improvement_opportunities = self.identify_improvement_opportunities(page_stats, site_name)
+                improvement_opportunities = self.identify_improvement_opportunities(
+                    page_stats, site_name,
+                    high_traffic_threshold=sessions_quantile_70,
+                    high_cvr_threshold=cvr_quantile_70
+                )
                 
                 site_report = {
                     'site_name': site_name,
@@ -483,9 +527,9 @@ class ContentPerformanceAnalyzer:
                     'improvement_opportunities': improvement_opportunities,
                     'summary_metrics': {
                         'avg_conversion_rate': round(page_stats['conversion_rate'].mean(), 2) if not page_stats.empty else 0,
-                        'total_sessions': int(site_data['sessions'].sum()),
-                        'total_conversions': int(site_data['conversions'].sum()),
-                        'high_cvr_pages_count': len(page_stats[page_stats['conversion_rate'] >= 5.0]) if not page_stats.empty else 0
+                        'total_sessions': int(totals['sessions']),
+                        'total_conversions': int(totals['conversions']),
+                        'high_cvr_pages_count': int(np.count_nonzero(page_stats['conversion_rate'].to_numpy() >= 5.0)) if not page_stats.empty else 0
                     }
                 }
                 
@@ -498,8 +542,7 @@ class ContentPerformanceAnalyzer:
             
             # レポート保存
             report_file = f'data/processed/content_performance_{start_date.replace("-", "")}_{end_date.replace("-", "")}.json'
-            with open(report_file, 'w', encoding='utf-8') as f:
-                json.dump(report, f, ensure_ascii=False, indent=2)
+            save_json(report, report_file)
             
             # Markdownレポート生成
             self._generate_markdown_report(report, start_date, end_date)
@@ -512,7 +555,8 @@ class ContentPerformanceAnalyzer:
     def _generate_markdown_report(self, report: Dict, start_date: str, end_date: str):
         """Markdownレポートの生成"""
         try:
-            markdown = f"""# 📊 コンテンツパフォーマンス分析レポート
+            # 断片をリストに集めて最後に1回だけ連結する
+            parts = [f"""# 📊 コンテンツパフォーマンス分析レポート
 
 **生成日時**: {datetime.now().strftime('%Y年%m月%d日 %H:%M')}
 **分析期間**: {start_date} - {end_date}
@@ -523,89 +567,89 @@ class ContentPerformanceAnalyzer:
 このレポートは、GA4のデータを活用してコンテンツのパフォーマンスを分析し、改善機会を特定したものです。
 
 ### 分析対象サイト
-"""
+"""]
             
             for site_name, site_data in report['sites'].items():
                 summary = site_data.get('summary_metrics', {})
-                markdown += f"- **{site_name}**: {summary.get('total_pages_analyzed', 0)}ページ分析\n"
-                markdown += f"  - 総セッション数: {summary.get('total_sessions', 0):,}\n"
-                markdown += f"  - 総コンバージョン数: {summary.get('total_conversions', 0):,}\n"
-                markdown += f"  - 平均CVR: {summary.get('avg_conversion_rate', 0):.2f}%\n"
-                markdown += f"  - 高CVRページ数: {summary.get('high_cvr_pages_count', 0)}ページ\n\n"
+                parts.append(f"- **{site_name}**: {summary.get('total_pages_analyzed', 0)}ページ分析\n")
+                parts.append(f"  - 総セッション数: {summary.get('total_sessions', 0):,}\n")
+                parts.append(f"  - 総コンバージョン数: {summary.get('total_conversions', 0):,}\n")
+                parts.append(f"  - 平均CVR: {summary.get('avg_conversion_rate', 0):.2f}%\n")
+                parts.append(f"  - 高CVRページ数: {summary.get('high_cvr_pages_count', 0)}ページ\n\n")
             
             # 各サイトの詳細分析
             for site_name, site_data in report['sites'].items():
-                markdown += f"## 🌐 {site_name.upper()}\n\n"
+                parts.append(f"## 🌐 {site_name.upper()}\n\n")
                 
                 # サマリーメトリクス
                 summary = site_data.get('summary_metrics', {})
-                markdown += f"### 📊 サマリーメトリクス\n\n"
-                markdown += f"- **分析ページ数**: {site_data.get('total_pages_analyzed', 0)}ページ\n"
-                markdown += f"- **平均CVR**: {summary.get('avg_conversion_rate', 0):.2f}%\n"
-                markdown += f"- **高CVRページ数**: {summary.get('high_cvr_pages_count', 0)}ページ\n\n"
+                parts.append(f"### 📊 サマリーメトリクス\n\n")
+                parts.append(f"- **分析ページ数**: {site_data.get('total_pages_analyzed', 0)}ページ\n")
+                parts.append(f"- **平均CVR**: {summary.get('avg_conversion_rate', 0):.2f}%\n")
+                parts.append(f"- **高CVRページ数**: {summary.get('high_cvr_pages_count', 0)}ページ\n\n")
                 
                 # チャネル別パフォーマンス
                 channel_perf = site_data.get('channel_performance', {})
                 if channel_perf.get('channels'):
-                    markdown += "### 🔄 流入チャネル別パフォーマンス\n\n"
-                    markdown += "| チャネル | セッション数 | CVR | バウンス率 | セッション時間 | エンゲージメント率 |\n"
-                    markdown += "|----------|------------|-----|------------|----------------|------------------|\n"
+                    parts.append("### 🔄 流入チャネル別パフォーマンス\n\n")
+                    parts.append("| チャネル | セッション数 | CVR | バウンス率 | セッション時間 | エンゲージメント率 |\n")
+                    parts.append("|----------|------------|-----|------------|----------------|------------------|\n")
                     
                     for channel in channel_perf['channels'][:10]:
-                        markdown += f"| {channel['channel']} | {channel['sessions']:,} | {channel['conversion_rate']}% | {channel['bounce_rate']}% | {channel['avg_session_duration']}秒 | {channel['engagement_rate']}% |\n"
-                    markdown += "\n"
+                        parts.append(f"| {channel['channel']} | {channel['sessions']:,} | {channel['conversion_rate']}% | {channel['bounce_rate']}% | {channel['avg_session_duration']}秒 | {channel['engagement_rate']}% |\n")
+                    parts.append("\n")
                 
                 # 高パフォーマンスパターン
                 patterns = site_data.get('high_performance_patterns', {})
                 if patterns.get('high_cvr_pages_count', 0) > 0:
-                    markdown += "### 🏆 高パフォーマンスパターン\n\n"
-                    markdown += f"- **高CVRページ数**: {patterns.get('high_cvr_pages_count', 0)}ページ\n"
-                    markdown += f"- **平均CVR**: {patterns.get('avg_cvr_high_performers', 0):.2f}%\n"
-                    markdown += f"- **平均バウンス率**: {patterns.get('avg_bounce_rate_high_performers', 0):.2f}%\n"
-                    markdown += f"- **平均セッション時間**: {patterns.get('avg_session_duration_high_performers', 0):.1f}秒\n\n"
+                    parts.append("### 🏆 高パフォーマンスパターン\n\n")
+                    parts.append(f"- **高CVRページ数**: {patterns.get('high_cvr_pages_count', 0)}ページ\n")
+                    parts.append(f"- **平均CVR**: {patterns.get('avg_cvr_high_performers', 0):.2f}%\n")
+                    parts.append(f"- **平均バウンス率**: {patterns.get('avg_bounce_rate_high_performers', 0):.2f}%\n")
+                    parts.append(f"- **平均セッション時間**: {patterns.get('avg_session_duration_high_performers', 0):.1f}秒\n\n")
                     
                     # カテゴリ別パフォーマンス
                     if patterns.get('common_path_patterns'):
-                        markdown += "#### 📂 カテゴリ別パフォーマンス\n\n"
-                        markdown += "| カテゴリ | ページ数 | 平均CVR | 最高CVR |\n"
-                        markdown += "|----------|----------|---------|----------|\n"
+                        parts.append("#### 📂 カテゴリ別パフォーマンス\n\n")
+                        parts.append("| カテゴリ | ページ数 | 平均CVR | 最高CVR |\n")
+                        parts.append("|----------|----------|---------|----------|\n")
                         
                         for pattern in patterns['common_path_patterns'][:5]:
-                            markdown += f"| {pattern['category']} | {pattern['page_count']} | {pattern['avg_cvr']}% | {pattern['max_cvr']}% |\n"
-                        markdown += "\n"
+                            parts.append(f"| {pattern['category']} | {pattern['page_count']} | {pattern['avg_cvr']}% | {pattern['max_cvr']}% |\n")
+                        parts.append("\n")
                     
                     # パフォーマンスインサイト
                     if patterns.get('performance_insights'):
-                        markdown += "#### 💡 パフォーマンスインサイト\n\n"
+                        parts.append("#### 💡 パフォーマンスインサイト\n\n")
                         for insight in patterns['performance_insights']:
-                            markdown += f"- {insight}\n"
-                        markdown += "\n"
+                            parts.append(f"- {insight}\n")
+                        parts.append("\n")
                 
                 # 改善機会
                 opportunities = site_data.get('improvement_opportunities', {})
                 if opportunities.get('high_priority'):
-                    markdown += "### 🎯 改善機会分析\n\n"
-                    markdown += f"#### 🔴 最優先改善（高トラフィック・低CVR）\n\n"
-                    markdown += "| ページパス | セッション数 | 現在CVR | 改善余地 |\n"
-                    markdown += "|------------|------------|---------|----------|\n"
+                    parts.append("### 🎯 改善機会分析\n\n")
+                    parts.append(f"#### 🔴 最優先改善（高トラフィック・低CVR）\n\n")
+                    parts.append("| ページパス | セッション数 | 現在CVR | 改善余地 |\n")
+                    parts.append("|------------|------------|---------|----------|\n")
                     
                     for page in opportunities['high_priority'][:10]:
                         improvement_potential = f"+{int(page['sessions'] * 0.02)} CV/月"
-                        markdown += f"| {page['page_path'][:50]}... | {page['sessions']:,} | {page['conversion_rate']}% | {improvement_potential} |\n"
-                    markdown += "\n"
+                        parts.append(f"| {page['page_path'][:50]}... | {page['sessions']:,} | {page['conversion_rate']}% | {improvement_potential} |\n")
+                    parts.append("\n")
                 
                 if opportunities.get('improvement_suggestions'):
-                    markdown += "#### 💡 改善提案\n\n"
+                    parts.append("#### 💡 改善提案\n\n")
                     for suggestion in opportunities['improvement_suggestions'][:5]:
                         priority_emoji = "🔴" if suggestion['priority'] == 'high' else "🟡"
-                        markdown += f"{priority_emoji} **{suggestion['page_path'][:40]}...**\n"
-                        markdown += f"   - 現在CVR: {suggestion['current_cvr']}%\n"
-                        markdown += f"   - 期待効果: {suggestion['potential_impact']}\n"
-                        markdown += f"   - 推奨施策: {', '.join(suggestion['suggested_actions'][:2])}\n\n"
+                        parts.append(f"{priority_emoji} **{suggestion['page_path'][:40]}...**\n")
+                        parts.append(f"   - 現在CVR: {suggestion['current_cvr']}%\n")
+                        parts.append(f"   - 期待効果: {suggestion['potential_impact']}\n")
+                        parts.append(f"   - 推奨施策: {', '.join(suggestion['suggested_actions'][:2])}\n\n")
                 
-                markdown += "---\n\n"
+                parts.append("---\n\n")
             
-            markdown += """## 📋 まとめ
+            parts.append("""## 📋 まとめ
 
 ### 主要な発見
 - 高パフォーマンスページの共通パターンを特定
@@ -620,7 +664,9 @@ class ContentPerformanceAnalyzer:
 
 ---
 *このレポートはコンテンツパフォーマンス分析ツールにより自動生成されました。*
-"""
+""")
+            
+            markdown = ''.join(parts)
             
             # ファイル保存
             markdown_file = f'data/processed/content_performance_{start_date.replace("-", "")}_{end_date.replace("-", "")}.md'
@@ -8,6 +8,9 @@ OAuth 2.0を使用したGoogle APIs統合システム
 
 import os
 import json
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
 from datetime import datetime, timedelta
 from google.auth.transport.requests import Request
@@ -27,6 +30,47 @@ SCOPES = [
     'https://www.googleapis.com/auth/webmasters.readonly'
 ]
 
+# get_ga4_data_concurrent に渡すGA4リクエスト定義
+GA4Query = namedtuple('GA4Query', ['metrics', 'dimensions', 'dimension_filter', 'row_limit'], defaults=(None, 10000))
+
+# GA4レスポンスのディスクキャッシュ保存先
+GA4_CACHE_DIR = 'data/cache'
+
+# categorical=True のときcategory型にする低カーディナリティのディメンション
+GA4_CATEGORICAL_DIMENSIONS = ('date', 'hour', 'deviceCategory', 'sessionDefaultChannelGrouping')
+
+def ga4_prefix_filter(field_name, prefix, exclude_prefix=None):
+    """
+    GA4 Data API v1betaのdimensionFilter（前方一致）を作成
+    
+    Args:
+        field_name (str): 対象ディメンション（例: landingPage, pagePath）
+        prefix (str): 含める前方一致の値
+        exclude_prefix (str): 除外する前方一致の値
+    
+    Returns:
+        dict: runReportのdimensionFilter
+    """
+    def begins_with(value):
+        return {
+            'filter': {
+                'fieldName': field_name,
+                'stringFilter': {'matchType': 'BEGINS_WITH', 'value': value}
+            }
+        }
+    
+    if not exclude_prefix:
+        return begins_with(prefix)
+    return {
+        'andGroup': {
+            'expressions': [
+                begins_with(prefix),
+                {'notExpression': begins_with(exclude_prefix)}
+            ]
+        }
+    }
+
+
 class OAuthGoogleAPIsIntegration:
     def __init__(self, credentials_path='config/oauth_credentials.json', token_path='config/token.json'):
         """
@@ -41,6 +85,8 @@ class OAuthGoogleAPIsIntegration:
         self.credentials = None
         self.ga4_service = None
         self.gsc_service = None
+        # 同一プロセス内で取得済みのGA4レスポンス（キャッシュパス -> (取得時刻, DataFrame)）
+        self._ga4_memo = {}
         
         # 設定の読み込み
         self.config = self._load_config()
@@ -107,15 +153,43 @@ class OAuthGoogleAPIsIntegration:
         except Exception as e:
             logger.error(f"認証エラー: {e}")
     
-    def get_ga4_data(self, date_range_days=30, metrics=None, dimensions=None, property_id=None):
+    def _thread_http(self):
+        """呼び出し元スレッド専用の認証済みHTTPクライアントを返す（_common.thread_http）"""
+        # _common はこのモジュールを読み込むため、循環importにならないよう呼び出し時に読み込む
+        from _common import thread_http
+        return thread_http(self.credentials)
+    
+    def _get_ga4_memo(self, path, cache_ttl):
+        """プロセス内に保持したTTL内の取得結果があればコピーを返す（なければNone）"""
+        memo = self._ga4_memo.get(path)
+        if memo is None or time.time() - memo[0] >= cache_ttl:
+            return None
+        return memo[1].copy()
+    
+    @staticmethod
+    def _categorize_ga4_dimensions(df):
+        """低カーディナリティのディメンション列をcategory型に変換した新しいDataFrameを返す"""
+        columns = [col for col in GA4_CATEGORICAL_DIMENSIONS if col in df.columns]
+        if not columns:
+            return df
+        return df.astype({col: 'category' for col in columns})
+    
+    def get_ga4_data(self, date_range_days=30, metrics=None, dimensions=None, property_id=None, cache_ttl=None,
+                     dimension_filter=None, categorical=False, row_limit=10000):
         """
         GA4からデータを取得
         
         Args:
             date_range_days (int): 取得する日数
             metrics (list): 取得するメトリクス
-            dimensions (list): 取得するディメンション
+            dimensions (list): 取得するディメンション（[]なら期間全体を1行で集計）
             property_id (str): GA4プロパティID（指定しない場合は設定から取得）
+            cache_ttl (int): 指定時は同一リクエストの結果をこの秒数だけキャッシュ
+                （プロセス内のメモリとdata/cache/のディスクの2段）
+            dimension_filter (dict): runReportのdimensionFilter（API側で行を絞り込む）
+            categorical (bool): Trueなら GA4_CATEGORICAL_DIMENSIONS の列をcategory型にする
+                （groupby時は observed=True を指定すること）
+            row_limit (int): 取得行数上限（runReportのlimit、最大250000）
         
         Returns:
             pd.DataFrame: GA4データ
@@ -141,8 +215,8 @@ class OAuthGoogleAPIsIntegration:
                 'conversions'
             ]
         
-        # デフォルトディメンション
-        if not dimensions:
+        # デフォルトディメンション（空リストはディメンションなし＝期間全体の1行集計）
+        if dimensions is None:
             dimensions = [
                 'date',
                 'pagePath',
@@ -155,6 +229,24 @@ class OAuthGoogleAPIsIntegration:
             end_date = datetime.now().strftime('%Y-%m-%d')
             start_date = (datetime.now() - timedelta(days=date_range_days)).strftime('%Y-%m-%d')
             
+            cache_path = None
+            if cache_ttl:
+                # _common はこのモジュールを読み込むため、循環importにならないよう呼び出し時に読み込む
+                from _common import cache_file_path, read_cache, write_cache
+                cache_path = cache_file_path(
+                    GA4_CACHE_DIR, 'ga4', property_id=prop_id, start_date=start_date, end_date=end_date,
+                    metrics=sorted(metrics), dimensions=sorted(dimensions),
+                    dimension_filter=dimension_filter, row_limit=row_limit
+                )
+                cached = self._get_ga4_memo(cache_path, cache_ttl)
+                if cached is None:
+                    cached = read_cache(cache_path, cache_ttl)
+                    if cached is not None:
+                        self._ga4_memo[cache_path] = (os.path.getmtime(cache_path), cached.copy())
+                if cached is not None:
+                    logger.info(f"GA4データ（キャッシュ）: {len(cached)}行")
+                    return self._categorize_ga4_dimensions(cached) if categorical else cached
+            
             logger.info(f"GA4データ取得: {start_date} 〜 {end_date}")
             logger.info(f"プロパティID: {prop_id}")
             
@@ -163,14 +255,16 @@ class OAuthGoogleAPIsIntegration:
                 'dateRanges': [{'startDate': start_date, 'endDate': end_date}],
                 'metrics': [{'name': metric} for metric in metrics],
                 'dimensions': [{'name': dimension} for dimension in dimensions],
-                'limit': 10000
+                'limit': row_limit
             }
+            if dimension_filter:
+                request_body['dimensionFilter'] = dimension_filter
             
             # API呼び出し
             response = self.ga4_service.properties().runReport(
                 property=f'properties/{prop_id}',
                 body=request_body
-            ).execute()
+            ).execute(http=self._thread_http())
             
             # データの変換
             data = []
@@ -197,7 +291,14 @@ class OAuthGoogleAPIsIntegration:
             
             df = pd.DataFrame(data)
             logger.info(f"GA4データ取得完了: {len(df)}行")
-            return df
+            # rowCount は limit に関係なく条件に合う全行数を返すため、取得上限での切り捨てを検知できる
+            row_count = int(response.get('rowCount', 0))
+            if row_count > len(df):
+                logger.warning(f"GA4データが取得上限で切り捨てられました: {len(df)}/{row_count}行（row_limit={row_limit}）")
+            if cache_path:
+                write_cache(cache_path, df)
+                self._ga4_memo[cache_path] = (time.time(), df.copy())
+            return self._categorize_ga4_dimensions(df) if categorical else df
             
         except HttpError as e:
             logger.error(f"GA4 API エラー: {e}")
@@ -208,6 +309,103 @@ class OAuthGoogleAPIsIntegration:
             logger.error(f"GA4データ取得エラー: {e}")
             return pd.DataFrame()
     
+    def get_ga4_scalar(self, metrics, date_range_days=30, property_id=None, dimension_filter=None):
+        """
+        ディメンションなしでGA4の期間全体の集計値を取得
+        
+        レスポンスは集計行が1行だけなので、DataFrameを作らず辞書で返す。
+        
+        Args:
+            metrics (list): 取得するメトリクス
+            date_range_days (int): 取得する日数
+            property_id (str): GA4プロパティID（指定しない場合は設定から取得）
+            dimension_filter (dict): runReportのdimensionFilter（API側で行を絞り込む）
+        
+        Returns:
+            dict: メトリクス名 -> 値（float）。取得失敗・データなしの場合は空の辞書
+        """
+        if not self.ga4_service:
+            logger.error("GA4サービスが初期化されていません")
+            return {}
+        
+        prop_id = property_id or self.ga4_property_id
+        if not prop_id:
+            logger.error("GA4プロパティIDが設定されていません")
+            return {}
+        
+        try:
+            end_date = datetime.now().strftime('%Y-%m-%d')
+            start_date = (datetime.now() - timedelta(days=date_range_days)).strftime('%Y-%m-%d')
+            
+            request_body = {
+                'dateRanges': [{'startDate': start_date, 'endDate': end_date}],
+                'metrics': [{'name': metric} for metric in metrics]
+            }
+            if dimension_filter:
+                request_body['dimensionFilter'] = dimension_filter
+            
+            response = self.ga4_service.properties().runReport(
+                property=f'properties/{prop_id}',
+                body=request_body
+            ).execute(http=self._thread_http())
+            
+            rows = response.get('rows', [])
+            if not rows:
+                return {}
+            
+            values = rows[0].get('metricValues', [])
+            return {metric: float(value.get('value', 0)) for metric, value in zip(metrics, values)}
+            
+        except HttpError as e:
+            logger.error(f"GA4 API エラー: {e}")
+            return {}
+        except Exception as e:
+            logger.error(f"GA4データ取得エラー: {e}")
+            return {}
+    
+    def get_ga4_data_concurrent(self, queries, date_range_days=30, property_id=None, max_workers=8, cache_ttl=None,
+                                categorical=False):
+        """
+        複数のGA4リクエストを並列に実行
+        
+        各リクエストは独立したHTTPSラウンドトリップのため、スレッドで同時に発行し
+        合計待ち時間を最も遅い1リクエスト分に抑える。
+        
+        Args:
+            queries (dict): 結果のキー -> GA4Query
+            date_range_days (int): 取得する日数
+            property_id (str): GA4プロパティID（指定しない場合は設定から取得）
+            max_workers (int): 同時実行数の上限
+            cache_ttl (int): get_ga4_data にそのまま渡すキャッシュ秒数
+            categorical (bool): get_ga4_data にそのまま渡すcategory型変換の指定
+        
+        Returns:
+            dict: 結果のキー -> pd.DataFrame（失敗時は空のDataFrame）
+        """
+        results = {}
+        if not queries:
+            return results
+        
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(queries)))) as ex:
+            futs = {
+                ex.submit(
+                    self.get_ga4_data,
+                    date_range_days=date_range_days,
+                    metrics=query.metrics,
+                    dimensions=query.dimensions,
+                    dimension_filter=query.dimension_filter,
+                    row_limit=query.row_limit,
+                    property_id=property_id,
+                    cache_ttl=cache_ttl,
+                    categorical=categorical
+                ): name
+                for name, query in queries.items()
+            }
+            for fut in as_completed(futs):
+                results[futs[fut]] = fut.result()
+        
+        return results
+    
     def get_gsc_data(self, date_range_days=30, dimensions=None, row_limit=25000, site_url=None):
         """
         Google Search Consoleからデータを取得
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+直近7日間の分析レポートをまとめて生成するスクリプト
+- analyze_7days: サイト全体の7日間分析
+- analyze_7days_purchase_only: 購入完了のみの7日間分析
+- analyze_moodmarkgift_7days: MOO:D MARK GIFT（SEOメディア）の7日間分析
+- analyze_funnel_contribution: GIFT → MOO:D MARK のファネル貢献度分析
+
+同一プロセスで続けて実行するため、OAuth認証済みクライアント（get_api_client）と
+共通GA4リクエストのキャッシュを両スクリプトで共有できる。
+"""
+
+from analyze_7days import analyze_7days
+from analyze_7days_purchase_only import analyze_7days_purchase_only
+from analyze_moodmarkgift_7days import analyze_moodmarkgift_7days
+from analyze_funnel_contribution import analyze_funnel_contribution
+
+
+def run_7days_all():
+    """7日間分析を順に実行"""
+    analyze_7days()
+    analyze_7days_purchase_only()
+    analyze_moodmarkgift_7days()
+    analyze_funnel_contribution()
+
+
+if __name__ == "__main__":
+    run_7days_all()
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""7日間分析スクリプト共通の集計ヘルパー。"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from datetime import date
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ANALYTICS = os.path.join(ROOT, "analytics")
+if ANALYTICS not in sys.path:
+    sys.path.insert(0, ANALYTICS)
+
+import _common  # noqa: E402
+from _common import (  # noqa: E402
+    COUNT_METRICS,
+    attach_pageviews,
+    build_cube,
+    cache_file_path,
+    contains_mask,
+    downcast_counts,
+    filter_path,
+    read_cache,
+    rollup_cube,
+    save_csv,
+    save_json,
+    site_kind,
+    site_masks,
+    startswith_mask,
+    thread_http,
+    to_arrow_strings,
+    unweight_rates,
+    weight_rates,
+    write_cache,
+)
+
+
+class TestAttachPageviews(unittest.TestCase):
+    def setUp(self):
+        self.session = pd.DataFrame(
+            {
+                "date": ["20241201", "20241202"],
+                "sessions": [5, 13],
+                "screenPageViews": [7, 20],
+                "conversions": [1, 2],
+            }
+        )
+        self.pv = pd.DataFrame({"date": ["20241202"], "screenPageViews": [42]})
+
+    def test_uses_pagepath_pageviews_and_fills_missing(self):
+        out = attach_pageviews(self.session, self.pv, "date", ["sessions"])
+        self.assertEqual(out.columns.tolist(), ["date", "sessions", "screenPageViews"])
+        self.assertEqual(out["sessions"].tolist(), [5, 13])
+        self.assertEqual(out["screenPageViews"].tolist(), [0, 42])
+
+    def test_categorical_keys(self):
+        session = self.session.copy()
+        pv = self.pv.copy()
+        session["date"] = session["date"].astype("category")
+        pv["date"] = pv["date"].astype("category")
+        out = attach_pageviews(session, pv, "date", ["sessions", "conversions"])
+        self.assertEqual(out["date"].tolist(), ["20241201", "20241202"])
+        self.assertEqual(out["screenPageViews"].tolist(), [0, 42])
+
+
+class TestContainsMask(unittest.TestCase):
+    def test_matches_str_contains(self):
+        paths = pd.Series(["/moodmarkgift/a", "/moodmark/b", None, "(not set)", np.nan])
+        out = contains_mask(paths, "/moodmarkgift/")
+        self.assertEqual(out.dtype, bool)
+        self.assertEqual(
+            out.tolist(), paths.str.contains("/moodmarkgift/", regex=False, na=False).tolist()
+        )
+
+    def test_case_insensitive(self):
+        source = pd.Series(["isetan / Referral", "google / organic"])
+        self.assertEqual(contains_mask(source, "referral", case=False).tolist(), [True, False])
+        self.assertEqual(contains_mask(source, "referral").tolist(), [False, False])
+
+    def test_startswith_matches_str_startswith(self):
+        paths = pd.Series(
+            ["/moodmarkgift/a", "/moodmark/b", "/x/moodmark/c", None, "/moodmark/b"], dtype="category"
+        )
+        out = startswith_mask(paths, "/moodmark/")
+        self.assertEqual(out.dtype, bool)
+        self.assertEqual(out.tolist(), [False, True, False, False, True])
+        self.assertEqual(
+            out.tolist(), paths.astype(object).str.startswith("/moodmark/", na=False).tolist()
+        )
+
+
+class TestDowncastCounts(unittest.TestCase):
+    def test_only_whole_number_columns(self):
+        df = pd.DataFrame(
+            {
+                "pagePath": ["/a", "/b"],
+                "sessions": [3.0, 4.0],
+                "bounceRate": [0.5, 0.25],
+                "purchaseRevenue": [1.0, np.nan],
+            }
+        )
+        out = downcast_counts(df, ["sessions", "bounceRate", "purchaseRevenue"])
+        self.assertEqual(out["sessions"].dtype, np.int32)
+        self.assertEqual(out["bounceRate"].dtype, np.float64)
+        self.assertEqual(out["purchaseRevenue"].dtype, np.float64)
+        self.assertEqual(out["pagePath"].tolist(), ["/a", "/b"])
+        self.assertEqual(df["sessions"].dtype, np.float64)
+
+    def test_whole_valued_rate_outside_columns_stays_float(self):
+        df = pd.DataFrame(
+            {
+                "sessions": [3.0, 4.0],
+                "bounceRate": [0.0, 1.0],
+                "purchaseRevenue": [1200.0, 800.0],
+            }
+        )
+        out = downcast_counts(df, COUNT_METRICS)
+        self.assertEqual(out["sessions"].dtype, np.int32)
+        self.assertEqual(out["bounceRate"].dtype, np.float64)
+        self.assertEqual(out["purchaseRevenue"].dtype, np.float64)
+
+
+class TestFilterPath(unittest.TestCase):
+    def test_filters_and_excludes(self):
+        df = pd.DataFrame(
+            {"landingPage": ["/moodmark/a", "/moodmarkgift/b", "/top"], "sessions": [1, 2, 3]}
+        )
+        out = filter_path(df, "/moodmark", column="landingPage", exclude="/moodmarkgift/")
+        self.assertEqual(out["sessions"].tolist(), [1])
+
+    def test_empty_frame_without_columns(self):
+        df = pd.DataFrame()
+        self.assertIs(filter_path(df, "/moodmarkgift/"), df)
+
+
+class TestToArrowStrings(unittest.TestCase):
+    def test_masks_match_object_columns(self):
+        df = pd.DataFrame({"pagePath": ["/moodmarkgift/a", "/moodmark/b", None], "sessions": [1.0, 2.0, 3.0]})
+        out = to_arrow_strings(df)
+        self.assertEqual(out["sessions"].dtype, np.float64)
+        self.assertEqual(
+            [m.tolist() for m in site_masks(out["pagePath"])],
+            [m.tolist() for m in site_masks(df["pagePath"])],
+        )
+        self.assertEqual(filter_path(out, "/moodmark/")["sessions"].tolist(), [2.0])
+
+
+class TestSiteMasks(unittest.TestCase):
+    def test_gift_and_ec_are_exclusive(self):
+        paths = pd.Series(
+            [
+                "/moodmarkgift/a",
+                "/moodmark/b",
+                "/top",
+                None,
+                "/moodmark/x/moodmarkgift/y",
+                "/moodmark/moodmarkgift/x",
+            ]
+        )
+        is_gift, is_ec = site_masks(paths)
+        self.assertEqual(is_gift.tolist(), [True, False, False, False, True, True])
+        self.assertEqual(is_ec.tolist(), [False, True, False, False, False, False])
+        self.assertEqual(is_gift.tolist(), contains_mask(paths, "/moodmarkgift/").tolist())
+        self.assertEqual(list(site_kind(paths))[-1], "gift")
+
+    def test_categorical_and_empty(self):
+        paths = pd.Series(["/moodmark/b", "/moodmarkgift/a", "/moodmark/b", None], dtype="category")
+        is_gift, is_ec = site_masks(paths)
+        self.assertEqual(is_gift.tolist(), [False, True, False, False])
+        self.assertEqual(is_ec.tolist(), [True, False, True, False])
+        self.assertEqual(contains_mask(paths, "/moodmark/").tolist(), [True, False, True, False])
+        is_gift, is_ec = site_masks(pd.Series([], dtype=object))
+        self.assertEqual((len(is_gift), len(is_ec)), (0, 0))
+
+    def test_site_kind(self):
+        paths = pd.Series(["/moodmarkgift/a", "/moodmark/b", "/top", np.nan, "/moodmark/b"])
+        kinds = site_kind(paths)
+        self.assertEqual(list(kinds.categories), ["gift", "ec", "other"])
+        self.assertEqual(list(kinds), ["gift", "ec", "other", "other", "ec"])
+
+
+class TestWeightedRates(unittest.TestCase):
+    def test_session_weighted_mean(self):
+        df = pd.DataFrame(
+            {
+                "deviceCategory": ["mobile", "mobile", "desktop"],
+                "sessions": [90, 10, 0],
+                "bounceRate": [0.2, 1.0, 0.5],
+            }
+        )
+        summary = weight_rates(df, ["bounceRate"]).groupby("deviceCategory", as_index=False).sum()
+        summary = unweight_rates(summary, ["bounceRate"]).set_index("deviceCategory")
+        self.assertAlmostEqual(summary.loc["mobile", "bounceRate"], 0.28)
+        self.assertEqual(summary.loc["desktop", "bounceRate"], 0)
+        self.assertEqual(df["bounceRate"].tolist(), [0.2, 1.0, 0.5])
+
+
+class TestCube(unittest.TestCase):
+    def test_rollup_matches_direct_groupby(self):
+        df = pd.DataFrame(
+            {
+                "pagePath": ["/a", "/a", "/b", "/b", "/b"],
+                "channel": ["Direct", "Email", "Direct", "Direct", "Email"],
+                "sessions": [10, 20, 30, 40, 50],
+                "bounceRate": [0.1, 0.2, 0.3, 0.4, 0.8],
+            }
+        )
+        spec = {"sessions": "sum", "bounceRate": "mean"}
+        cube = build_cube(df, ["pagePath", "channel"], spec)
+        for dimension in ("pagePath", "channel"):
+            expected = df.groupby(dimension).agg(spec).reset_index()
+            pd.testing.assert_frame_equal(rollup_cube(cube, dimension, spec), expected)
+
+    def test_empty_frame(self):
+        self.assertTrue(build_cube(pd.DataFrame(), ["pagePath"], {"sessions": "sum"}).empty)
+
+
+class TestCache(unittest.TestCase):
+    def test_round_trip_and_ttl(self):
+        df = pd.DataFrame({"pagePath": ["/a"], "sessions": [1.0]})
+        with tempfile.TemporaryDirectory() as tmp:
+            path = cache_file_path(tmp, "ga4", metrics=["sessions"], start_date="2024-12-01")
+            self.assertEqual(path, cache_file_path(tmp, "ga4", start_date="2024-12-01", metrics=["sessions"]))
+            self.assertNotEqual(path, cache_file_path(tmp, "gsc", metrics=["sessions"], start_date="2024-12-01"))
+            self.assertIsNone(read_cache(path, 60))
+            write_cache(path, df)
+            pd.testing.assert_frame_equal(read_cache(path, 60), df)
+            pd.testing.assert_frame_equal(read_cache(path, None), df)
+            os.utime(path, (0, 0))
+            self.assertIsNone(read_cache(path, 60))
+            self.assertEqual(os.listdir(tmp), [os.path.basename(path)])
+
+
+class TestThreadHttp(unittest.TestCase):
+    def test_one_client_per_thread_and_credentials(self):
+        credentials, other = object(), object()
+        http = thread_http(credentials)
+        self.assertIs(thread_http(credentials), http)
+        self.assertIs(http.credentials, credentials)
+        self.assertIsNot(thread_http(other), http)
+        self.assertIsNot(thread_http(credentials, timeout=60), http)
+
+        in_thread = []
+        worker = threading.Thread(target=lambda: in_thread.append(thread_http(credentials)))
+        worker.start()
+        worker.join()
+        self.assertIsNot(in_thread[0], http)
+        self.assertIs(in_thread[0].credentials, credentials)
+
+
+class TestSaveCsv(unittest.TestCase):
+    def test_writes_bom_and_round_trips(self):
+        df = pd.DataFrame({"deviceCategory": ["mobile", "デスクトップ"], "sessions": [3, 4]})
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "out.csv")
+            save_csv(df, path)
+            with open(path, "rb") as f:
+                self.assertTrue(f.read().startswith(b"\xef\xbb\xbf"))
+            back = pd.read_csv(path, encoding="utf-8-sig")
+        self.assertEqual(back["deviceCategory"].tolist(), ["mobile", "デスクトップ"])
+        self.assertEqual(back["sessions"].tolist(), [3, 4])
+
+    def test_bytes_match_to_csv(self):
+        df = pd.DataFrame(
+            {
+                "date": pd.Series(["20241201", "20241202"], dtype="category"),
+                "pagePath": pd.Series(["/moodmarkgift/a", None], dtype="string[pyarrow]"),
+                "sessions": np.array([3, 4], dtype=np.int32),
+                "bounceRate": [1.0, np.nan],
+                "is_gift": [True, False],
+            }
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "out.csv")
+            save_csv(df, path)
+            with open(path, "rb") as f:
+                data = f.read()
+        self.assertEqual(data, b"\xef\xbb\xbf" + df.to_csv(index=False).encode("utf-8"))
+
+
+class TestSaveJson(unittest.TestCase):
+    def test_numpy_scalars_and_non_ascii(self):
+        report = {
+            "period": "直近7日間",
+            "summary": {"total_sessions": np.int64(12), "purchase_cvr": np.float64(1.5)},
+        }
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "report.json")
+            save_json(report, path)
+            with open(path, encoding="utf-8") as f:
+                text = f.read()
+        self.assertIn("直近7日間", text)
+        self.assertEqual(
+            json.loads(text)["summary"], {"total_sessions": 12, "purchase_cvr": 1.5}
+        )
+
+    def test_orjson_and_json_paths_agree(self):
+        report = {
+            "rates": [0.5, float("nan"), np.float64("inf"), np.int32(3)],
+            "generated_at": pd.Timestamp("2024-12-01 09:30"),
+            "missing": [pd.NaT, pd.NA, None],
+            "values": np.array([1.0, np.nan]),
+            "by_key": {1: "int", 1.5: "float", None: "none", date(2024, 12, 2): "date"},
+        }
+        expected = {
+            "rates": [0.5, None, None, 3],
+            "generated_at": "2024-12-01T09:30:00",
+            "missing": [None, None, None],
+            "values": [1.0, None],
+            "by_key": {"1": "int", "1.5": "float", "null": "none", "2024-12-02": "date"},
+        }
+        with tempfile.TemporaryDirectory() as tmp:
+            outputs = []
+            for name, module in (("orjson", _common.orjson), ("json", None)):
+                path = os.path.join(tmp, f"{name}.json")
+                with mock.patch.object(_common, "orjson", module):
+                    save_json(report, path)
+                with open(path, "rb") as f:
+                    outputs.append(f.read())
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertNotIn(b"NaN", outputs[1])
+        self.assertEqual(json.loads(outputs[1]), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()